@@ -1,18 +1,23 @@
+# Standalone script, run from the repository root. It shares the translation cache of the pipeline package,
+# and translates with a local MarianMT model, so install both first:
+#   pip install ./pipeline transformers==4.13.0 torch==1.13.0
 import os.path
 import feedparser
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
-from transformers import pipeline
+from pipeline.translation import Translator, TranslationCache, MarianBackend
 import pandas as pd
 from tqdm import tqdm
 import re
 from time import sleep
 import json
+import logging
 # from newspaper import Article
 # from newspaper.article import ArticleException
 # import spacyturk
 # import spacy
 from dotenv import load_dotenv
+logging.basicConfig(level=logging.INFO)
 credentials_path = 'credentials'
 if os.path.exists(f"{credentials_path}/.env"):
     load_dotenv(dotenv_path=f"{credentials_path}/.env")
@@ -23,8 +28,10 @@ if os.path.exists(f"{credentials_path}/.env"):
 # nlp = spacy.load("tr_floret_web_md")
 # nlp.add_pipe('sentencizer')
 
-# initialize the translator
-tr_en_translator = pipeline("translation_tr_to_en", model=f"Helsinki-NLP/opus-mt-tr-en")
+# initialize the translator, with a persistent cache of translations
+# (the model itself is only loaded if there is anything new to translate)
+translator = Translator(MarianBackend("Helsinki-NLP/opus-mt-tr-en", task="translation_tr_to_en"),
+                        TranslationCache('data/translations.sqlite'))
 
 # initialize google sheets api
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
@@ -47,6 +54,8 @@ sources = {
 keywords = ['earthquake', 'victim', 'destruction', 'destroyed', 'damage', 'emergency', 'body', 'bodies', 'tent', 'collapse',
             'rubble', 'survive', 'survivors']
 entries = []
+new_entries = []
+old_links = set(df_old_values['Link'])
 
 for source_name, source_url in sources.items():
     print('start source', source_name)
@@ -54,37 +63,40 @@ for source_name, source_url in sources.items():
     NewsFeed = feedparser.parse(source_url)
 
     for entry in NewsFeed.entries:
+        # skip if link already present, before translating anything
+        if entry['link'] in old_links:
+            continue
+        new_entries.append((source_name, entry))
 
-        title = re.sub(r"<(.*)>", "", entry['title'])
-        title_en = tr_en_translator(title)[0]['translation_text']
-        if 'summary' in entry.keys():
-            summary = re.sub(r"<(.*)>", "", entry['summary'])
-            summary_en = tr_en_translator(summary)[0]['translation_text']
-        else:
-            summary_en = title_en
+# translate all titles and summaries at once
+titles = [re.sub(r"<(.*)>", "", entry['title']) for _, entry in new_entries]
+summaries = [re.sub(r"<(.*)>", "", entry['summary']) if 'summary' in entry.keys() else '' for _, entry in new_entries]
+translations = translator.translate_many(titles + summaries)
+titles_en, summaries_en = translations[:len(titles)], translations[len(titles):]
+translator.log_report()
 
-        # filter by keyword
-        if not any(keyword.lower() in title_en.lower() or keyword.lower() in summary_en.lower() for keyword in keywords):
-            print(title_en)
-            print(summary_en)
-            print('not about earthquake')
-            continue
+for (source_name, entry), title_en, summary_en in zip(new_entries, titles_en, summaries_en):
+    if 'summary' not in entry.keys():
+        summary_en = title_en
 
-        # skip if link already present
-        if entry['link'] in df_old_values['Link'].unique():
-            continue
+    # filter by keyword
+    if not any(keyword.lower() in title_en.lower() or keyword.lower() in summary_en.lower() for keyword in keywords):
+        print(title_en)
+        print(summary_en)
+        print('not about earthquake')
+        continue
 
-        datetime = pd.to_datetime(entry['published'])
-        entry_simple = {
-            'Date': datetime.strftime("%d/%m/%Y"),
-            'Time': datetime.strftime("%H:%M"),
-            'information': summary_en,
-            'Source': source_name,
-            'Source+datetime': f'{source_name}, {datetime.strftime("%d/%m/%Y")} {datetime.strftime("%H:%M")}',
-            'Link': entry['link'],
-            'datetime': datetime
-        }
-        entries.append(entry_simple)
+    datetime = pd.to_datetime(entry['published'])
+    entry_simple = {
+        'Date': datetime.strftime("%d/%m/%Y"),
+        'Time': datetime.strftime("%H:%M"),
+        'information': summary_en,
+        'Source': source_name,
+        'Source+datetime': f'{source_name}, {datetime.strftime("%d/%m/%Y")} {datetime.strftime("%H:%M")}',
+        'Link': entry['link'],
+        'datetime': datetime
+    }
+    entries.append(entry_simple)
 
 entries_sorted = sorted(entries, key=lambda d: d['datetime'])
 print('updating Google sheet')
@@ -0,0 +1,88 @@
+"""
+Compare the serial article download (requests.get + BeautifulSoup) with the pooled downloader, as the
+pipeline runs it: ArticleDownloader.fetch in a bounded window of threads (ordered_map), then extract_paragraphs.
+Serves synthetic article pages from local HTTP servers (one per "host") with artificial latency.
+Run from the pipeline directory:  python benchmarks/bench_articles.py --articles 200 --latency 0.1
+"""
+import time
+import random
+import argparse
+import threading
+import http.server
+import requests
+from bs4 import BeautifulSoup
+from pipeline.articles import ArticleDownloader, extract_paragraphs
+from pipeline.stream import ordered_map
+
+words = "the aid convoy reached idlib after the earthquake while sanctions delayed cross-border operations".split()
+
+
+def make_page(n_paragraphs=30, seed=0):
+    rnd = random.Random(seed)
+    paragraphs = ''.join(f"<p>{' '.join(rnd.choices(words, k=60))}</p>" for _ in range(n_paragraphs))
+    nav = ''.join(f'<li><a href="/{i}">link {i}</a></li>' for i in range(200))
+    return f"<html><head><title>article</title></head><body><ul>{nav}</ul>{paragraphs}</body></html>".encode()
+
+
+def start_server(latency, page):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serial(urls):
+    pages = {}
+    for url in urls:
+        res = requests.get(url)
+        if res.status_code == 200:
+            soup = BeautifulSoup(res.content, 'html.parser')
+            pages[url] = [p.get_text() for p in soup.find_all('p')]
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--articles', type=int, default=200)
+    parser.add_argument('--hosts', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--per-host', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    page = make_page()
+    servers = [start_server(args.latency, page) for _ in range(args.hosts)]
+    urls = [f"http://127.0.0.1:{servers[i % args.hosts].server_port}/article/{i}" for i in range(args.articles)]
+
+    start = time.perf_counter()
+    expected = serial(urls)
+    t_serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    downloader = ArticleDownloader(max_workers=args.workers, per_host=args.per_host)
+    pages = {url: extract_paragraphs(*page) if page is not None else None
+             for url, page in ordered_map(downloader.fetch, urls, max_workers=downloader.max_workers)}
+    t_pooled = time.perf_counter() - start
+
+    assert all(pages[url] == expected[url] for url in urls)
+    print(f"{args.articles} articles, {args.hosts} hosts, {args.latency * 1000:.0f} ms latency")
+    print(f"serial:  {t_serial:.2f}s ({args.articles / t_serial:.1f} articles/s)")
+    print(f"pooled:  {t_pooled:.2f}s ({args.articles / t_pooled:.1f} articles/s)")
+    print(f"speedup: {t_serial / t_pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Compare the KeywordMatcher with the generator expression previously used in main(),
+on synthetic English and Arabic articles of realistic size.
+Run from the pipeline directory:  python benchmarks/bench_matcher.py
+"""
+import random
+import timeit
+from pipeline.matcher import KeywordMatcher
+
+english_query = ["Syrian Arab Red Crescent", "Syrian Red Crescent", "Khaled Hboubati", "Khaled Erksoussi",
+                 "Hossam Elsharkawi", "Mey Al Sayegh", "Idlib", "Idleb", "Safe access", "sanctions",
+                 "cross-border aid", "crossline operations", "cholera", "north-west Syria", "northwest Syria",
+                 "quake", "earthquake"]
+arabic_query = ["إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود", "العمليات عبر الحدود", "الكوليرا",
+                "شمالي غربي سوريا", "إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود",
+                "العمليات عبر الحدود", "الكوليرا", "هزة أرضية", "شمالي غربي سوريا"]
+keywords = english_query + arabic_query
+
+english_words = "the government said on monday that talks on the new budget would continue next week".split()
+arabic_words = "قالت الحكومة يوم الاثنين إن المحادثات بشأن الميزانية الجديدة ستستمر الأسبوع المقبل".split()
+
+
+def make_text(words, n_words, seed):
+    rnd = random.Random(seed)
+    return ' '.join(rnd.choices(words, k=n_words))
+
+
+def old_match(title, content):
+    return any(keyword.lower() in title.lower() or keyword.lower() in content.lower() for keyword in keywords)
+
+
+def main():
+    matcher = KeywordMatcher(keywords)
+    print(f"{len(keywords)} keywords, {len(matcher)} after normalization and deduplication")
+    for n_words in (100, 1000, 5000):
+        for language, words in (('en', english_words), ('ar', arabic_words)):
+            # irrelevant texts are the common (and worst) case: every keyword gets checked
+            docs = [(make_text(words, 12, i), make_text(words, n_words, i)) for i in range(20)]
+            number = 20
+            t_old = min(timeit.repeat(lambda: [old_match(t, c) for t, c in docs], number=number, repeat=3))
+            t_search = min(timeit.repeat(lambda: [matcher.search(t, c) for t, c in docs], number=number, repeat=3))
+            t_findall = min(timeit.repeat(lambda: [matcher.findall(t, c) for t, c in docs], number=number, repeat=3))
+            per_doc = 1e6 / (number * len(docs))
+            print(f"{language} {n_words:>5} words: generator {t_old * per_doc:8.1f} us, "
+                  f"search {t_search * per_doc:8.1f} us ({t_old / t_search:4.1f}x), "
+                  f"findall {t_findall * per_doc:8.1f} us ({t_old / t_findall:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Build the near-duplicate index (MinHash LSH, see pipeline/near_duplicates.py) on synthetic articles,
+a fraction of which are light rewrites of earlier ones by other sources, and report indexing throughput,
+lookup latency, precision/recall of the detected duplicates and the size of the index. First checks that
+distinct articles of one source, sharing most of their text (the site's footer and sidebar), are not
+near duplicates of each other.
+Run from the pipeline directory:  python benchmarks/bench_near_duplicates.py --documents 100000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from pipeline.near_duplicates import NearDuplicateIndex
+
+vocabulary = [f"w{i}" for i in range(20000)] + ["syria", "idlib", "earthquake", "aid", "convoy", "سوريا", "إدلب"]
+
+
+def make_documents(n, duplicate_rate, edit_rate, rng):
+    """(key, text, source, key of the original or None) for `n` documents."""
+    documents = []
+    for i in range(n):
+        if documents and rng.random() < duplicate_rate:
+            original = rng.choice(documents)
+            original_key = original[3] or original[0]
+            words = original[1].split()
+            for j in range(len(words)):
+                if rng.random() < edit_rate:
+                    words[j] = rng.choice(vocabulary)
+            source = rng.choice([f"source{j}" for j in range(7) if f"source{j}" != original[2]])
+            documents.append((f"doc{i}", ' '.join(words), source, original_key))
+        else:
+            text = ' '.join(rng.choices(vocabulary, k=rng.randint(80, 400)))
+            documents.append((f"doc{i}", text, f"source{i % 7}", None))
+    return documents
+
+
+def check_same_source(rng):
+    """Distinct articles of one site, mostly boilerplate, are kept; the same text on another site is not."""
+    boilerplate = ' '.join(rng.choices(vocabulary, k=350))
+    articles = [' '.join(rng.choices(vocabulary, k=60)) + ' ' + boilerplate for _ in range(5)]
+    index = NearDuplicateIndex(os.path.join(tempfile.mkdtemp(), 'near_duplicates.sqlite'))
+    found = index.add_many((f"enab/{i}", text, 'Enab Baladi') for i, text in enumerate(articles))
+    assert all(duplicate is None for duplicate in found.values()), found
+    found = index.add_many([('sabah/0', articles[0], 'Daily Sabah')])
+    assert found == {'sabah/0': 'enab/0'}, found
+    assert index.query(articles[1], source='Enab Baladi') is None
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--edit-rate', type=float, default=0.02, help="fraction of the words changed in a rewrite")
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check_same_source(rng)
+    documents = make_documents(args.documents, args.duplicate_rate, args.edit_rate, rng)
+    path = os.path.join(tempfile.mkdtemp(), 'near_duplicates.sqlite')
+    index = NearDuplicateIndex(path)
+
+    start = time.perf_counter()
+    found = {}
+    for i in range(0, len(documents), args.batch):
+        found.update(index.add_many((key, text, source) for key, text, source, _ in documents[i:i + args.batch]))
+    elapsed = time.perf_counter() - start
+
+    # a duplicate counts as found if it is matched to any document of its original's cluster
+    clusters = {key: original or key for key, _, _, original in documents}
+    true_positives = sum(found[key] is not None and clusters[found[key]] == clusters[key]
+                         for key, _, _, original in documents if original)
+    detected = sum(duplicate is not None for duplicate in found.values())
+    actual = sum(original is not None for *_, original in documents)
+
+    latencies = []
+    for key, text, _, _ in rng.sample(documents, min(args.queries, len(documents))):
+        start_query = time.perf_counter()
+        index.query(text)
+        latencies.append(time.perf_counter() - start_query)
+    latencies = np.array(latencies) * 1000
+
+    # the index lives in SQLite, only a batch of signatures is in Python memory at a time
+    tracemalloc.start()
+    index.add_many((f"extra{i}", text, source) for i, (_, text, source, _) in enumerate(documents[:args.batch]))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(documents)} documents indexed in {elapsed:.1f}s ({len(documents) / elapsed:.0f} documents/s)")
+    print(f"near duplicates: {detected} detected, {actual} actual, "
+          f"precision {true_positives / max(detected, 1):.3f}, recall {true_positives / max(actual, 1):.3f}")
+    print(f"lookup latency: p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    print(f"index: {os.path.getsize(path) / 2 ** 20:.1f} MiB on disk "
+          f"({os.path.getsize(path) / len(documents):.0f} bytes/document), "
+          f"peak Python memory while indexing a batch {peak / 2 ** 20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Throughput of the page parser (HTML parsing, keyword/location scan and language of article pages, see
+pipeline/parsing.py) against the number of worker processes, on synthetic pages.
+Run from the pipeline directory:  python benchmarks/bench_parsing.py --pages 2000 --workers 1 2 4 8
+Worker processes are started before timing; with one worker, pages are parsed in the calling thread.
+"""
+import os
+import time
+import random
+import argparse
+from pipeline.parsing import PageParser
+from pipeline.pipeline import english_query, arabic_query
+
+words = ("the aid convoy reached idlib after the earthquake while sanctions delayed cross-border operations "
+         "وصلت قافلة المساعدات إلى سوريا بعد الزلزال").split()
+
+
+def make_page(i, n_paragraphs=40):
+    rng = random.Random(i)
+    paragraphs = ''.join(f"<p>{' '.join(rng.choices(words, k=60))}</p>" for _ in range(n_paragraphs))
+    nav = ''.join(f'<li><a href="/{j}">link {j}</a></li>' for j in range(300))
+    # no <meta charset>, pages are decoded with the charset of the response
+    return (f"<html><head><title>article {i}</title><script>var x = '<p>';</script></head>"
+            f"<body><ul>{nav}</ul><article>{paragraphs}</article></body></html>").encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    pages = [make_page(i) for i in range(args.pages)]
+    print(f"{args.pages} pages of {sum(map(len, pages)) / len(pages) / 1024:.0f} KiB, {os.cpu_count()} cores")
+    baseline = None
+    for workers in args.workers:
+        page_parser = PageParser(english_query + arabic_query, workers=workers)
+        list(page_parser.map((i, (page, 'utf-8', None)) for i, page in enumerate(pages[:workers])))  # start the workers
+        start = time.perf_counter()
+        tasks = ((i, (page, 'utf-8', None)) for i, page in enumerate(pages))
+        results = [result for _, _, result in page_parser.map(tasks)]
+        elapsed = time.perf_counter() - start
+        page_parser.close()
+        assert all(result.keywords and result.about_location for result in results)
+        baseline = baseline or elapsed
+        print(f"{workers:>3} workers: {elapsed:6.2f}s, {args.pages / elapsed:7.0f} pages/s, "
+              f"speedup {baseline / elapsed:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
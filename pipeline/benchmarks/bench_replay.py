@@ -0,0 +1,128 @@
+"""
+Run the pipeline on replayed fixtures (see replay.py): `main()` end to end, then stage by stage
+(sync, articles, tweets), and report throughput and peak memory (tracemalloc) at every scale.
+Fixtures are synthetic, of every combination of --sources x --entries (per feed) x --tweets (per account),
+or recorded with record.py (--fixtures). Every run starts from an empty data directory.
+Run from the pipeline directory:
+    python benchmarks/bench_replay.py --sources 10 100 --entries 50 --tweets 200 2000 --latency 0.05
+    python benchmarks/bench_replay.py --fixtures fixtures/2023-02-10
+Timings are measured without tracemalloc, peak memory in separate runs.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+import contextlib
+import pipeline.pipeline as pipeline_module
+from replay import replaying, synthetic_fixtures
+
+
+@contextlib.contextmanager
+def fresh_data():
+    # the pipeline keeps its state in ../data, relative to the working directory
+    cwd = os.getcwd()
+    run_path = os.path.join(tempfile.mkdtemp(), 'run')
+    os.makedirs(run_path)
+    os.chdir(run_path)
+    try:
+        yield os.path.join(run_path, '..', 'data')
+    finally:
+        os.chdir(cwd)
+
+
+def measure(fn, memory):
+    """(seconds, peak traced bytes or None) of fn()."""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn()
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_main(fixtures, latency, memory):
+    with fresh_data() as data, replaying(fixtures, latency) as (session, api, service):
+        elapsed, peak = measure(pipeline_module.main, memory)
+        with open(os.path.join(data, 'run_report.json')) as f:
+            report = json.load(f)
+    return elapsed, peak, report, (session.calls, api.calls, service.calls)
+
+
+def run_stages(fixtures, feeds, accounts, latency, memory):
+    results = {}
+    with fresh_data(), replaying(fixtures, latency) as (session, api, service):
+        pipeline = pipeline_module.Pipeline()
+        results['sync'] = measure(pipeline.sync, memory)
+        results['articles'] = measure(lambda: pipeline.run_articles(feeds), memory)
+        results['tweets'] = measure(lambda: pipeline.run_tweets(accounts), memory)
+    return results
+
+
+def mib(peak):
+    return f"{peak / 2 ** 20:7.1f} MiB"
+
+
+def benchmark(fixtures, feeds, accounts, latency):
+    pipeline_module.sources = feeds
+    pipeline_module.twitter_sources = accounts
+    elapsed, _, report, calls = run_main(fixtures, latency, memory=False)
+    _, peak, _, _ = run_main(fixtures, latency, memory=True)
+    # items are the feed entries and tweets going through
+    n_entries = report['stages'].get('feed_parse', {}).get('total', {}).get('entries_in', 0)
+    n_tweets = report['stages'].get('twitter_fetch', {}).get('total', {}).get('entries_out', 0)
+    items = n_entries + n_tweets
+    print(f"  main(): {elapsed:7.2f}s, {items / elapsed:8.0f} items/s, peak {mib(peak)}, "
+          f"{calls[0]} HTTP, {calls[1]} Twitter, {calls[2]} Sheets calls, {len(report['errors'])} errors")
+    for error in report['errors']:
+        print(f"    error in {error['stage']}: {error['error'].strip().splitlines()[-1]}")
+    for stage, stage_report in sorted(report['stages'].items(), key=lambda item: -item[1]['total'].get('seconds', 0)):
+        total = stage_report['total']
+        if total.get('seconds'):
+            print(f"    {stage:<18} {total['seconds']:7.2f}s in {total.get('calls', 0):6} calls, "
+                  f"{total.get('entries_in', 0):7} in, {total.get('entries_out', 0):7} out")
+
+    timings = run_stages(fixtures, feeds, accounts, latency, memory=False)
+    peaks = run_stages(fixtures, feeds, accounts, latency, memory=True)
+    for stage, items in (('sync', 0), ('articles', n_entries), ('tweets', n_tweets)):
+        elapsed = timings[stage][0]
+        throughput = f"{items / elapsed:8.0f} items/s" if items else ' ' * 16
+        print(f"  {stage:<8} {elapsed:7.2f}s, {throughput}, peak {mib(peaks[stage][1])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', help="recorded fixtures (record.py), instead of synthetic ones")
+    parser.add_argument('--sources', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--entries', type=int, nargs='+', default=[50], help="entries per feed")
+    parser.add_argument('--accounts', type=int, default=13)
+    parser.add_argument('--tweets', type=int, nargs='+', default=[200, 2000], help="tweets per account")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per HTTP, Twitter and Sheets call")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    if not args.verbose:
+        pipeline_module.handler.setLevel(logging.WARNING)
+
+    if args.fixtures:
+        fixtures = os.path.abspath(args.fixtures)
+        print(f"{fixtures}, latency {args.latency}s")
+        benchmark(fixtures, pipeline_module.sources, pipeline_module.twitter_sources, args.latency)
+        return
+    for n_sources, n_entries, n_tweets in itertools.product(args.sources, args.entries, args.tweets):
+        fixtures = os.path.join(tempfile.mkdtemp(), 'fixtures')
+        feeds, accounts = synthetic_fixtures(fixtures, n_sources, n_entries, args.accounts, n_tweets)
+        print(f"{n_sources} sources x {n_entries} entries, {args.accounts} accounts x {n_tweets} tweets, "
+              f"latency {args.latency}s")
+        benchmark(fixtures, feeds, accounts, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Measure the import time of the get-rss-feed entry point and check that no heavy dependency is loaded at import.
+Every measurement runs in a fresh interpreter, using python -X importtime.
+Run from the pipeline directory:  python benchmarks/bench_startup.py --max-ms 500
+Exits with 1 if a heavy module is imported eagerly or the import takes longer than --max-ms.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+heavy_modules = ['pandas', 'numpy', 'tweepy', 'googleapiclient.discovery', 'google.cloud.translate_v2',
+                 'google.oauth2', 'bs4', 'lxml.html', 'pyarrow', 'transformers', 'torch']
+
+
+def import_time_ms(module):
+    """Cumulative import time of `module` in a fresh interpreter, in milliseconds."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=os.environ)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+    for line in reversed(result.stderr.splitlines()):
+        if line.startswith('import time:') and line.split('|')[-1].strip() == module:
+            return int(line.split('|')[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def loaded_modules(module):
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='pipeline.pipeline')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    entry_point = min(import_time_ms(args.module) for _ in range(args.repeat))
+    print(f"import {args.module}: {entry_point:.0f} ms (best of {args.repeat})")
+
+    eager = sorted(module for module in heavy_modules if module in loaded_modules(args.module))
+    for module in heavy_modules:
+        try:
+            print(f"  import {module}: {import_time_ms(module):.0f} ms" + (" (eager!)" if module in eager else ""))
+        except RuntimeError:
+            print(f"  import {module}: not installed")
+
+    failed = False
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and entry_point > args.max_ms:
+        print(f"FAIL: import takes {entry_point:.0f} ms, more than {args.max_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Peak memory (tracemalloc) of an articles pass of the streaming pipeline against the number of entries,
+with synthetic feeds, articles and a Google Sheets service that only counts the rows it receives.
+Run from the pipeline directory:  python benchmarks/bench_stream.py --sources 10 100 1000
+Peak memory should stay about the same whatever the number of entries going through.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import feedparser
+import pipeline.pipeline as pipeline_module
+from pipeline.feeds import FeedResult
+from pipeline.pipeline import Pipeline
+from pipeline.seen_index import SeenIndex
+
+item = ("<item><guid>https://news.example/{source}/{i}</guid><link>https://news.example/{source}/{i}</link>"
+        "<title>Earthquake in Syria, update {i}</title><description>Aid reaches Idlib after the quake</description>"
+        "<pubDate>Mon, 06 Feb 2023 {hour:02d}:{minute:02d}:00 +0000</pubDate></item>")
+
+
+class CountingService:
+    """Sheets service that keeps nothing but the number of rows appended."""
+
+    def __init__(self):
+        self.rows = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return self
+
+    def append(self, body, **kwargs):
+        self.rows += len(body['values'])
+        return self
+
+    def execute(self):
+        return {}
+
+
+def synthetic_feeds(sources, entries_per_feed):
+    def iter_feeds(feeds, session=None, **kwargs):
+        for n, source_name in enumerate(feeds):
+            rss = "<rss><channel><title>x</title>" + ''.join(
+                item.format(source=n, i=i, hour=i // 60 % 24, minute=i % 60) for i in range(entries_per_feed)
+            ) + "</channel></rss>"
+            yield FeedResult(source_name, feeds[source_name], entries=feedparser.parse(rss).entries)
+    return iter_feeds
+
+
+words = "aid convoys reached idlib after the earthquake in north-west syria while talks continued".split()
+
+
+def make_page(url):
+    # different text for every article, so that they are not near duplicates of each other
+    rng = random.Random(url)
+    paragraphs = ''.join(f"<p>{' '.join(rng.choices(words, k=30))}</p>" for _ in range(20))
+    return f"<html><body>{paragraphs}</body></html>".encode(), 'utf-8'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sources', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--entries', type=int, default=50, help="entries per feed")
+    args = parser.parse_args()
+
+    pipeline_module.save_feed_state = lambda feeds: None
+    for n in args.sources:
+        # local state (article cache, near duplicates, ...) goes to ../data, start from an empty one
+        run_path = os.path.join(tempfile.mkdtemp(), 'run')
+        os.makedirs(run_path)
+        os.chdir(run_path)
+        pipeline_module.iter_feeds = synthetic_feeds(n, args.entries)
+        service = CountingService()
+        pipeline = Pipeline(service=service, seen_index=SeenIndex(os.path.join(tempfile.mkdtemp(), 'seen.sqlite')))
+        pipeline.downloader.fetch = make_page
+        pipeline.sync()
+        sources = {f'Source {i}': f'https://news.example/{i}/rss' for i in range(n)}
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        pipeline.run_articles(sources)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{n * args.entries:>8} entries: {service.rows:>8} rows in {elapsed:6.2f}s, "
+              f"peak memory {peak / 2 ** 20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compare the columnar tweet formatting and filtering with the previous row-by-row path
+(ast.literal_eval, apply(axis=1) and iterrows) on synthetic tweets.
+Run from the pipeline directory:  python benchmarks/bench_tweets.py --sizes 10000 100000 1000000
+The old path is only run up to --old-max tweets, it takes minutes beyond that.
+"""
+import os
+import ast
+import random
+import argparse
+import datetime
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pipeline.pipeline import format_df, filter_tweets
+from pipeline.matcher import KeywordMatcher
+from pipeline.filters import is_about_location
+from pipeline.seen_index import SeenIndex, normalize_url
+
+keywords = ["Idlib", "sanctions", "cholera", "earthquake", "quake", "إدلب", "الكوليرا", "هزة أرضية"]
+words = ("the aid convoy reached syria after the earthquake while talks continued in the capital "
+         "وصلت قافلة المساعدات إلى سوريا بعد الزلزال").split()
+
+
+def make_tweets(n, seed=0):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    tweets = []
+    for i in range(n):
+        created_at = start + datetime.timedelta(minutes=rnd.randrange(60 * 24 * 200))
+        has_url = rnd.random() < 0.5
+        tweets.append({
+            'id': 10 ** 18 + i,
+            'created_at': created_at.strftime('%a %b %d %H:%M:%S %z %Y'),
+            'full_text': ' '.join(rnd.choices(words, k=25)),
+            'user': {'name': f'Account {i % 13}', 'screen_name': f'account{i % 13}', 'verified': False},
+            'entities': {'hashtags': [], 'urls': [{'expanded_url': f'https://news.example/{i}'}] if has_url else []},
+            'geo': None, 'coordinates': None, 'place': None,
+            'retweet_count': rnd.randrange(100), 'favorite_count': rnd.randrange(100),
+            'possibly_sensitive': False, 'lang': 'en'
+        })
+    return tweets
+
+
+def old_format_df(df_tweets):
+    def get_url_from_entities(entities):
+        try:
+            return entities['urls'][0]['expanded_url']
+        except (KeyError, IndexError, TypeError):
+            return np.nan
+
+    df_tweets['user'] = df_tweets['user'].astype(str).apply(ast.literal_eval)
+    df_tweets['source'] = df_tweets['user'].apply(lambda x: x['name'])
+    df_tweets['screen_name'] = df_tweets['user'].apply(lambda x: x['screen_name'])
+    df_tweets['entities'] = df_tweets['entities'].astype(str).apply(ast.literal_eval)
+    df_tweets['url'] = df_tweets['entities'].apply(get_url_from_entities)
+    df_tweets['twitter_url'] = df_tweets.apply(
+        lambda row: f"https://twitter.com/{row['screen_name']}/status/{row['id']}", axis=1)
+    df_tweets['url'] = df_tweets['url'].fillna(df_tweets['twitter_url'])
+    df_tweets['created_at'] = pd.to_datetime(df_tweets['created_at'])
+    df_tweets['created_at'] = df_tweets['created_at'].dt.tz_localize(None)
+    return df_tweets[['created_at', 'id', 'full_text', 'source', 'geo', 'coordinates', 'place', 'retweet_count',
+                      'favorite_count', 'possibly_sensitive', 'lang', 'url']]
+
+
+def old_filter(df_tweets, df_old_values):
+    df_tweets['relevant'] = True
+    for ix, row in df_tweets.iterrows():
+        if row['url'] in df_old_values['url'].unique():
+            df_tweets.at[ix, 'relevant'] = False
+        if row['created_at'].date() < datetime.date.fromisoformat('2023-02-06'):
+            df_tweets.at[ix, 'relevant'] = False
+        if not ('syria' in row['full_text'] or 'سوريا' in row['full_text']):
+            df_tweets.at[ix, 'relevant'] = False
+        if not any(keyword.lower() in row['full_text'].lower() for keyword in keywords):
+            df_tweets.at[ix, 'relevant'] = False
+    return df_tweets[df_tweets['relevant']].drop(columns=['relevant'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--old-max', type=int, default=100000)
+    parser.add_argument('--seen', type=int, default=1000, help="number of urls already in the sheet")
+    args = parser.parse_args()
+
+    matcher = KeywordMatcher(keywords)
+    seen_urls = [f'https://news.example/{i}' for i in range(0, 2 * args.seen, 2)]
+    df_old_values = pd.DataFrame({'url': seen_urls})
+    seen_index = SeenIndex(os.path.join(tempfile.mkdtemp(), 'seen.sqlite'))
+    seen_index.add_many(('tweet_url', normalize_url(url), None, None) for url in seen_urls)
+
+    for n in args.sizes:
+        tweets = make_tweets(n)
+        start = time.perf_counter()
+        new = filter_tweets(format_df(tweets), matcher, seen_index)
+        t_new = time.perf_counter() - start
+        line = f"{n:>8} tweets: columnar {t_new:7.2f}s ({n / t_new:9.0f} tweets/s, {len(new)} relevant)"
+        if n <= args.old_max:
+            start = time.perf_counter()
+            old = old_filter(old_format_df(pd.DataFrame.from_records(tweets)), df_old_values)
+            t_old = time.perf_counter() - start
+            # the new location filter is case-insensitive, so it can only keep more tweets
+            assert set(old['id']) <= set(new['id'])
+            assert all(is_about_location(text) for text in new['full_text'])
+            line += f", row-by-row {t_old:7.2f}s ({n / t_old:7.0f} tweets/s), speedup {t_old / t_new:5.1f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
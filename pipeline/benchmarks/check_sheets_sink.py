@@ -0,0 +1,91 @@
+"""
+Check the retries of SheetsSink (see pipeline/sinks.py) against a sheet whose appends fail as scripted
+(FaultySheetsService in replay.py): the delay doubles on 429s and decays after successful calls, rows
+written in part or in full by a failed call are found by reading the sheet back and never appended twice,
+errors that are not transient or keep failing past `max_retries` are raised.
+Run from the pipeline directory:  python benchmarks/check_sheets_sink.py
+"""
+import logging
+from types import SimpleNamespace
+import pipeline.pipeline as pipeline_module
+from pipeline.sinks import SheetsSink
+from replay import FaultySheetsService, ServiceError
+
+header = ['Date', 'Time', 'Title']
+
+
+def make_rows(n, prefix='row'):
+    return [["06/02/2023", f"{i // 60:02d}:{i % 60:02d}", f"{prefix} {i}"] for i in range(n)]
+
+
+def make_sink(faults, chunk_size=10, max_retries=8):
+    """Sink on a sheet holding the header only, the delays it sleeps are in `sink.delays`."""
+    service = FaultySheetsService(SimpleNamespace(load_sheets=lambda: {'Articles': [header]}), faults)
+    delays = []
+    written = []
+    sink = SheetsSink(service, 'spreadsheet', 'Articles!A:C', start_row=1, key_column=2, chunk_size=chunk_size,
+                      max_retries=max_retries, sleep=delays.append, on_write=written.extend)
+    sink.delays, sink.written = delays, written
+    return service, sink
+
+
+def write(sink, rows):
+    for row in rows:
+        sink.add(row)
+    sink.close()
+
+
+def check_quota():
+    # 429s on the first chunk, then successful calls
+    service, sink = make_sink(['quota', 'quota', None, None, None, None])
+    rows = make_rows(40)
+    write(sink, rows)
+    assert service.rows['Articles'] == [header] + rows
+    assert sink.delays == [1.0, 2.0, 1.0, 0.5, 0.25], sink.delays
+    assert sink.delay == 0.125 and sink.retries == 2 and sink.calls == 6, (sink.delay, sink.retries, sink.calls)
+    assert sink.rows_written == 40 and sink.next_row == 42
+
+
+def check_resume():
+    # every kind of failure that may leave rows behind, then one more in the same chunk
+    faults = [None, 'partial', 'error', None, 'timeout', 'partial', 'timeout', None]
+    service, sink = make_sink(faults)
+    rows = make_rows(45)
+    write(sink, rows)
+    assert service.rows['Articles'] == [header] + rows, [row[2] for row in service.rows['Articles'][1:]]
+    assert sink.rows_written == 45 and sink.next_row == 47, (sink.rows_written, sink.next_row)
+    assert sink.retries == 5, sink.retries
+    assert sink.written == rows  # on_write once per row, in order
+
+
+def check_failures():
+    # not transient: raised at once, without retrying
+    service, sink = make_sink(['invalid'])
+    try:
+        write(sink, make_rows(3))
+    except ServiceError as e:
+        assert e.resp.status == 400
+    else:
+        raise AssertionError("400 not raised")
+    assert sink.retries == 0 and sink.delays == []
+    # transient but past max_retries: raised after them
+    service, sink = make_sink(['error'] * 4, max_retries=3)
+    try:
+        write(sink, make_rows(3))
+    except ServiceError as e:
+        assert e.resp.status == 503
+    else:
+        raise AssertionError("503 not raised after max_retries")
+    assert sink.retries == 3 and service.rows['Articles'] == [header]
+
+
+def main():
+    pipeline_module.handler.setLevel(logging.ERROR)
+    check_quota()
+    check_resume()
+    check_failures()
+    print("SheetsSink: backoff on 429, resume after partial writes and timeouts, no duplicate rows")
+
+
+if __name__ == "__main__":
+    main()
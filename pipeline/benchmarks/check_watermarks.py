@@ -0,0 +1,178 @@
+"""
+Check that the per-source watermarks (see pipeline/watermarks.py) skip exactly the entries the original
+DataFrame filter skipped: already in the sheet (same link) or older than the latest row of their source,
+the sheet's Date/Time being read as UTC+03:00. The sheet is synthetic (--rows, 100k by default),
+entries are new and seen links around the watermark of every source, in feeds of various timezones,
+and from a source that is not in the sheet yet. Also checks the feed-level skip, which uses the
+channel's `updated` date only, and that entries dated without a timezone (taken to be UTC) get the same
+watermark during the run as once saved in the seen index. Asserts on any difference and reports the
+time per entry of both.
+Run from the pipeline directory:  python benchmarks/check_watermarks.py --rows 100000 --entries 2000
+"""
+import os
+import time
+import random
+import logging
+import argparse
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import pandas as pd
+from pipeline.feeds import parse_published
+import pipeline.pipeline as pipeline_module
+from pipeline.pipeline import article_columns
+from pipeline.seen_index import SeenIndex, article_keys, normalize_url
+from pipeline.sinks import as_utc_iso
+from pipeline.watermarks import WatermarkStore, as_utc, feed_updated
+from replay import ReplaySheetsService
+
+sources = ['Alahednews', 'Enab Baladi', 'Daily Sabah', 'Kurdpress', 'Al Jazeera', 'Al Arabiya', 'Middle East Monitor']
+sheet_timezone = timezone(timedelta(hours=3))
+start = datetime(2022, 1, 1)
+timezones = [timezone.utc, sheet_timezone, timezone(timedelta(hours=-5)), timezone(timedelta(hours=5, minutes=30))]
+
+
+def make_sheet(n_rows, rng):
+    """Rows of the Articles sheet (header first), in the order they were appended; the last source is left out."""
+    rows = [article_columns]
+    for i in range(n_rows):
+        published = start + timedelta(minutes=i * 5 + rng.randint(0, 4))
+        source = rng.choice(sources[:-1])
+        rows.append([published.strftime("%d/%m/%Y"), published.strftime("%H:%M"), f"title {i}", f"content {i}",
+                     source, f"{source}, {published.strftime('%d/%m/%Y %H:%M')}",
+                     f"https://news.example/{source.replace(' ', '-').lower()}/{i}", "earthquake"])
+    return rows
+
+
+def make_entries(sheet, n_entries, rng):
+    """(source, link, published) of feed entries: links of the sheet and new ones, around the watermarks."""
+    latest = {}
+    for row in sheet[1:]:
+        published = datetime.strptime(f"{row[0]} {row[1]}", "%d/%m/%Y %H:%M").replace(tzinfo=sheet_timezone)
+        latest[row[4]] = max(latest.get(row[4], published), published)
+    entries = []
+    for i in range(n_entries):
+        source = rng.choice(sources)
+        watermark = latest.get(source, start.replace(tzinfo=sheet_timezone))
+        # within a day of the watermark, a tenth of them exactly on it
+        offset = timedelta(0) if rng.random() < 0.1 else timedelta(minutes=rng.randint(-24 * 60, 24 * 60))
+        published = (watermark + offset).astimezone(rng.choice(timezones))
+        if rng.random() < 0.3:
+            link = rng.choice(sheet[1:])[6]
+        else:
+            link = f"https://news.example/new/{i}"
+        entries.append((source, link, format_datetime(published)))
+    return entries
+
+
+def old_skips(sheet, entries):
+    """Skip decisions of the original filter, on a DataFrame of the whole sheet."""
+    df_old_values = pd.DataFrame.from_records(sheet[1:], columns=sheet[0])
+    df_old_values['datetime'] = pd.to_datetime(
+        df_old_values['Date'].astype(str) + ' ' + df_old_values['Time'].astype(str),
+        format="%d/%m/%Y %H:%M"
+    )
+    skips = []
+    for source_name, link, published in entries:
+        datetime_entry = pd.to_datetime(published)
+        if link in df_old_values['Link'].unique():
+            skips.append('seen')
+        elif datetime_entry < df_old_values[df_old_values['Source'] == source_name]['datetime'].max().tz_localize(
+                'UTC+03:00'):
+            skips.append('older')
+        else:
+            skips.append(None)
+    return skips
+
+
+def new_skips(seen_index, watermarks, entries):
+    """Skip decisions of Pipeline.new_entries, on the seen index and the watermarks."""
+    skips = []
+    for source_name, link, published in entries:
+        if seen_index.seen('article', normalize_url(link)):
+            skips.append('seen')
+        elif watermarks.is_older(source_name, parse_published(published)):
+            skips.append('older')
+        else:
+            skips.append(None)
+    return skips
+
+
+def check_feed_updated(watermarks, entries, old):
+    # a feed is only skipped if its channel `updated` date is before the watermark, the channel
+    # `published` date (when the feed was first published) says nothing about its latest entries
+    updated = datetime(2023, 2, 6, tzinfo=timezone.utc)
+    assert feed_updated({'published_parsed': updated.timetuple()}) is None
+    assert feed_updated({'updated_parsed': updated.timetuple()}) == updated
+    # for a stale feed, whose entries are all older than its `updated` date, all of them were skipped
+    for source in sources[:-1]:
+        watermark = watermarks.get(source)
+        feed = {'updated_parsed': (watermark - timedelta(minutes=1)).timetuple()}
+        assert watermarks.feed_is_stale(source, feed)
+        stale = [i for i, (source_name, _, published) in enumerate(entries)
+                 if source_name == source and parse_published(published) <= watermark - timedelta(minutes=1)]
+        assert all(old[i] is not None for i in stale), source
+    assert not watermarks.feed_is_stale(sources[-1], {'updated_parsed': start.timetuple()})
+
+
+def check_naive_timestamps():
+    seen_index = SeenIndex(os.path.join(tempfile.mkdtemp(), 'seen.sqlite'))
+    for published in ('Mon, 06 Feb 2023 10:00:00 -0000', '2023-02-06T10:00:00'):
+        datetime_entry = parse_published(published)
+        assert datetime_entry.tzinfo is None, published
+        # saved by the pipeline: watermark updated during the run, keys of the row in the seen index
+        watermarks = WatermarkStore()
+        watermarks.update('Enab Baladi', datetime_entry)
+        row = {'Link': f"https://news.example/{published}", 'Source': 'Enab Baladi', 'datetime': datetime_entry}
+        seen_index.add_many(article_keys(row), sheet='Articles')
+        persisted = WatermarkStore.from_index(seen_index)
+        assert persisted.get('Enab Baladi') == watermarks.get('Enab Baladi') == as_utc(datetime_entry), published
+        assert datetime.fromisoformat(as_utc_iso(datetime_entry)) == watermarks.get('Enab Baladi')  # output sinks
+    # Date/Time read back from the sheet are in UTC+03:00
+    key, = article_keys({'Link': 'https://news.example/sheet', 'Date': '06/02/2023', 'Time': '13:00'})
+    assert key[3] == '2023-02-06T10:00:00+00:00', key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    pipeline_module.handler.setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    sheet = make_sheet(args.rows, rng)
+    entries = make_entries(sheet, args.entries, rng)
+
+    t = time.perf_counter()
+    old = old_skips(sheet, entries)
+    t_old = time.perf_counter() - t
+
+    service = ReplaySheetsService(SimpleNamespace(load_sheets=lambda: {'Articles': sheet}))
+    seen_index = SeenIndex(os.path.join(tempfile.mkdtemp(), 'seen.sqlite'))
+    t = time.perf_counter()
+    seen_index.sync(service, 'spreadsheet', 'Articles!A:H', article_keys)
+    watermarks = WatermarkStore.from_index(seen_index)
+    t_sync = time.perf_counter() - t
+    t = time.perf_counter()
+    new = new_skips(seen_index, watermarks, entries)
+    t_new = time.perf_counter() - t
+
+    differences = [(entry, a, b) for entry, a, b in zip(entries, old, new) if a != b]
+    for entry, a, b in differences[:10]:
+        print(f"  {entry}: {a} before, {b} now")
+    assert not differences, f"{len(differences)} of {len(entries)} decisions differ"
+    check_feed_updated(watermarks, entries, old)
+    check_naive_timestamps()
+
+    counts = {decision: new.count(decision) for decision in ('seen', 'older', None)}
+    print(f"{args.rows} rows, {len(entries)} entries: {counts['seen']} seen, {counts['older']} older than the "
+          f"watermark, {counts[None]} kept, same decisions")
+    print(f"DataFrame filter: {t_old / len(entries) * 1e3:8.3f} ms per entry")
+    print(f"watermarks:       {t_new / len(entries) * 1e3:8.3f} ms per entry, after {t_sync:.2f}s to index the sheet")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Run the pipeline once against the live feeds, news sites, Twitter and Google sheet, recording everything
+it reads as fixtures (see replay.py) for bench_replay.py. Nothing is written to the sheet, and the run
+uses a fresh data directory so that the whole sheet is read and every article is downloaded.
+Run from the pipeline directory, with the credentials in ../credentials:
+    python benchmarks/record.py fixtures/2023-02-10
+"""
+import os
+import argparse
+import tempfile
+import pipeline.pipeline as pipeline_module
+from replay import recording
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures', help="directory to write the fixtures to")
+    args = parser.parse_args()
+
+    fixtures = os.path.abspath(args.fixtures)
+    pipeline_module.credentials_path = os.path.abspath(pipeline_module.credentials_path)
+    run_path = os.path.join(tempfile.mkdtemp(), 'run')
+    os.makedirs(run_path)
+    os.chdir(run_path)  # ../data is then a fresh data directory
+    with recording(fixtures):
+        pipeline_module.main()
+    print(f"Fixtures written to {fixtures}")
+
+
+if __name__ == "__main__":
+    main()
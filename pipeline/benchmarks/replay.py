@@ -0,0 +1,446 @@
+"""
+Record/replay of the pipeline's external services, to run and measure it without Google, Twitter and
+the news sites.
+
+Fixtures are a directory with
+  http.jsonl                one line per URL: status, headers and the file of the body (feeds and articles)
+  http/<sha1 of url>        bodies
+  twitter/<screen name>.jsonl   every tweet returned by user_timeline, one JSON per line
+  sheets/<sheet>.json       rows of the sheet, as read by the pipeline
+
+`recording(path)` wraps the real clients so that a live run writes its fixtures (see record.py),
+`replaying(fixtures)` replaces them by fakes serving the fixtures, each call waiting `latency` seconds
+(see bench_replay.py). `synthetic_fixtures` writes fixtures of any size. `FaultySheetsService` fails
+appends as scripted, to check the retries of SheetsSink (see check_sheets_sink.py).
+"""
+import os
+import re
+import json
+import time
+import types
+import random
+import socket
+import hashlib
+import datetime
+import threading
+import contextlib
+from requests.structures import CaseInsensitiveDict
+import pipeline.pipeline as pipeline_module
+import pipeline.articles as articles_module
+
+tweet_time_format = '%a %b %d %H:%M:%S %z %Y'
+
+
+class Fixtures:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.sheets = {}
+        for directory in ('http', 'twitter', 'sheets'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    # recording
+
+    def record_response(self, url, status, headers, content):
+        body = os.path.join('http', hashlib.sha1(url.encode()).hexdigest())
+        with self._lock:
+            with open(os.path.join(self.path, body), 'wb') as f:
+                f.write(content)
+            with open(os.path.join(self.path, 'http.jsonl'), 'a') as f:
+                f.write(json.dumps({'url': url, 'status': status, 'headers': dict(headers), 'body': body}) + '\n')
+
+    def record_tweets(self, screen_name, tweets):
+        with self._lock:
+            with open(os.path.join(self.path, 'twitter', f'{screen_name}.jsonl'), 'a') as f:
+                for tweet in tweets:
+                    f.write(json.dumps(tweet) + '\n')
+
+    def record_rows(self, sheet, start, values):
+        with self._lock:
+            rows = self.sheets.setdefault(sheet, [])
+            rows.extend([[]] * (start - 1 + len(values) - len(rows)))
+            rows[start - 1:start - 1 + len(values)] = values
+
+    def save(self):
+        for sheet, rows in self.sheets.items():
+            with open(os.path.join(self.path, 'sheets', f'{sheet}.json'), 'w') as f:
+                json.dump(rows, f)
+
+    # replaying
+
+    def responses(self):
+        """{url: (status, headers, body)}, the last response recorded for every URL."""
+        responses = {}
+        index = os.path.join(self.path, 'http.jsonl')
+        if os.path.exists(index):
+            with open(index) as f:
+                for line in f:
+                    response = json.loads(line)
+                    responses[response['url']] = (response['status'], response['headers'],
+                                                  os.path.join(self.path, response['body']))
+        return responses
+
+    def tweets(self):
+        """{screen name: tweets, newest first}."""
+        accounts = {}
+        for file in os.listdir(os.path.join(self.path, 'twitter')):
+            with open(os.path.join(self.path, 'twitter', file)) as f:
+                tweets = {tweet['id']: tweet for tweet in map(json.loads, f)}
+            accounts[file[:-len('.jsonl')]] = sorted(tweets.values(), key=lambda tweet: -tweet['id'])
+        return accounts
+
+    def load_sheets(self):
+        sheets = {}
+        for file in os.listdir(os.path.join(self.path, 'sheets')):
+            with open(os.path.join(self.path, 'sheets', file)) as f:
+                sheets[file[:-len('.json')]] = json.load(f)
+        return sheets
+
+
+def parse_range(spreadsheet_range):
+    """(sheet, first row, last row) of a range like 'Articles!A2:H1001', rows are None in 'Articles!A:H'."""
+    sheet, cells = spreadsheet_range.split('!')
+    match = re.match(r'[A-Z]+(\d*)(?::[A-Z]+(\d*))?$', cells)
+    first, last = match.groups()
+    return sheet, int(first) if first else None, int(last) if last else None
+
+
+# recording wrappers around the live clients
+
+
+class RecordingSession:
+    """requests.Session that records every response. Conditional headers are dropped so that fixtures have bodies."""
+
+    def __init__(self, session, fixtures):
+        self.session = session
+        self.fixtures = fixtures
+
+    def get(self, url, headers=None, **kwargs):
+        headers = {key: value for key, value in (headers or {}).items()
+                   if key not in ('If-None-Match', 'If-Modified-Since')}
+        res = self.session.get(url, headers=headers, **kwargs)
+        self.fixtures.record_response(url, res.status_code, res.headers, res.content)
+        return res
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class RecordingTwitterAPI:
+    def __init__(self, api, fixtures):
+        self.api = api
+        self.fixtures = fixtures
+
+    def user_timeline(self, **kwargs):
+        page = self.api.user_timeline(**kwargs)
+        self.fixtures.record_tweets(kwargs['screen_name'], [status._json for status in page])
+        return page
+
+
+class _Request:
+    def __init__(self, execute):
+        self._execute = execute
+
+    def execute(self):
+        return self._execute()
+
+
+class RecordingSheetsService:
+    """
+    Sheets service recording the rows read with values().get(). Appends do not reach the live sheet,
+    so that recording a run has no effect on it.
+    """
+
+    def __init__(self, service, fixtures):
+        self.service = service
+        self.fixtures = fixtures
+        self.appended = {}
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        def execute():
+            result = self.service.spreadsheets().values().get(**kwargs).execute()
+            sheet, first, _ = parse_range(kwargs['range'])
+            self.fixtures.record_rows(sheet, first or 1, result.get('values', []))
+            return result
+        return _Request(execute)
+
+    def append(self, range, body, **kwargs):
+        sheet, _, _ = parse_range(range)
+
+        def execute():
+            with self.fixtures._lock:
+                start = len(self.fixtures.sheets.get(sheet, [])) + self.appended.get(sheet, 0) + 1
+                self.appended[sheet] = self.appended.get(sheet, 0) + len(body['values'])
+            return {'updates': {'updatedRange': f"{sheet}!A{start}:{range.split(':')[-1]}"
+                                                f"{start + len(body['values']) - 1}"}}
+        return _Request(execute)
+
+
+# fakes replaying the fixtures
+
+
+class ReplayResponse:
+    def __init__(self, url, status_code, headers=None, content=b''):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.content = content
+        self.raw = None
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class ReplaySession:
+    """Serves the recorded responses (404 for unknown URLs), and 304 to a matching If-None-Match."""
+
+    def __init__(self, fixtures, latency=0.0):
+        self.responses = fixtures.responses()
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, headers=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if url not in self.responses:
+            return ReplayResponse(url, 404)
+        status, response_headers, body = self.responses[url]
+        etag = CaseInsensitiveDict(response_headers).get('ETag')
+        if etag is not None and (headers or {}).get('If-None-Match') == etag:
+            return ReplayResponse(url, 304, response_headers)
+        with open(body, 'rb') as f:
+            return ReplayResponse(url, status, response_headers, f.read())
+
+    def mount(self, prefix, adapter):
+        pass
+
+
+class Status:
+    def __init__(self, json):
+        self._json = json
+        self.id = json['id']
+
+
+class ReplayTwitterAPI:
+    """user_timeline over the recorded tweets, honoring count, since_id and max_id."""
+
+    def __init__(self, fixtures, latency=0.0):
+        self.accounts = fixtures.tweets()
+        self.latency = latency
+        self.calls = 0
+
+    def user_timeline(self, screen_name, count=20, since_id=None, max_id=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        page = []
+        for tweet in self.accounts.get(screen_name, []):
+            if max_id is not None and tweet['id'] > max_id:
+                continue
+            if since_id is not None and tweet['id'] <= since_id:
+                break
+            page.append(Status(tweet))
+            if len(page) >= count:
+                break
+        return page
+
+
+class ReplaySheetsService:
+    """A sheet in memory, starting from the recorded rows; appends are kept (`rows`) but not saved."""
+
+    def __init__(self, fixtures, latency=0.0):
+        self.rows = fixtures.load_sheets()
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def _call(self, fn):
+        def execute():
+            self.calls += 1
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                return fn()
+        return _Request(execute)
+
+    def get(self, spreadsheetId, range, **kwargs):
+        sheet, first, last = parse_range(range)
+        rows = self.rows.setdefault(sheet, [])
+        first = first or 1
+        last = last or len(rows)
+        return self._call(lambda: {'values': rows[first - 1:last]} if rows[first - 1:last] else {})
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        sheet, _, _ = parse_range(range)
+        rows = self.rows.setdefault(sheet, [])
+
+        def append():
+            start = len(rows) + 1
+            rows.extend(body['values'])
+            return {'updates': {'updatedRange': f"{sheet}!A{start}:{range.split(':')[-1]}{len(rows)}"}}
+        return self._call(append)
+
+
+class ServiceError(Exception):
+    """Error of a Google API call, with the HTTP status in `resp.status` like googleapiclient's HttpError."""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = types.SimpleNamespace(status=status)
+
+
+class FaultySheetsService(ReplaySheetsService):
+    """
+    ReplaySheetsService whose appends fail as scripted in `faults`, one per append call (None or
+    exhausted: the append succeeds):
+      'quota'    429 before anything is written
+      'error'    503 before anything is written
+      'timeout'  socket timeout after all the rows are written
+      'partial'  503 after half of the rows are written
+      'invalid'  400, not worth retrying
+    """
+
+    def __init__(self, fixtures, faults=(), latency=0.0):
+        super().__init__(fixtures, latency)
+        self.faults = list(faults)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        request = super().append(spreadsheetId, range, body, **kwargs)
+        fault = self.faults.pop(0) if self.faults else None
+        if fault is None:
+            return request
+        sheet, _, _ = parse_range(range)
+
+        def execute():
+            self.calls += 1
+            if fault == 'quota':
+                raise ServiceError(429)
+            if fault == 'invalid':
+                raise ServiceError(400)
+            if fault == 'error':
+                raise ServiceError(503)
+            with self._lock:
+                values = body['values'] if fault == 'timeout' else body['values'][:len(body['values']) // 2]
+                self.rows.setdefault(sheet, []).extend(values)
+            if fault == 'timeout':
+                raise socket.timeout("The read operation timed out")
+            raise ServiceError(503)
+        return _Request(execute)
+
+
+@contextlib.contextmanager
+def patched(session, twitter_api, sheets_service):
+    """Make the pipeline (and main()) use these clients for feeds, articles, Twitter and Sheets."""
+    saved = (pipeline_module.get_sheets_service, pipeline_module.get_twitter_api, pipeline_module.Pipeline,
+             articles_module.make_session)
+
+    class Pipeline(saved[2]):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.feed_session = session
+
+    pipeline_module.get_sheets_service = lambda: sheets_service
+    pipeline_module.get_twitter_api = lambda: twitter_api
+    pipeline_module.Pipeline = Pipeline
+    articles_module.make_session = lambda **kwargs: session
+    try:
+        yield Pipeline
+    finally:
+        (pipeline_module.get_sheets_service, pipeline_module.get_twitter_api, pipeline_module.Pipeline,
+         articles_module.make_session) = saved
+
+
+@contextlib.contextmanager
+def recording(path):
+    """Run the live pipeline inside, recording what it reads into fixtures at `path`."""
+    fixtures = Fixtures(path)
+    session = RecordingSession(articles_module.make_session(), fixtures)
+    with patched(session, RecordingTwitterAPI(pipeline_module.get_twitter_api(), fixtures),
+                 RecordingSheetsService(pipeline_module.get_sheets_service(), fixtures)):
+        try:
+            yield fixtures
+        finally:
+            fixtures.save()
+
+
+@contextlib.contextmanager
+def replaying(path, latency=0.0, http_latency=None, twitter_latency=None, sheets_latency=None):
+    """Run the pipeline inside on the fixtures at `path`; yields (session, Twitter API, Sheets service)."""
+    fixtures = Fixtures(path)
+    session = ReplaySession(fixtures, latency if http_latency is None else http_latency)
+    api = ReplayTwitterAPI(fixtures, latency if twitter_latency is None else twitter_latency)
+    service = ReplaySheetsService(fixtures, latency if sheets_latency is None else sheets_latency)
+    with patched(session, api, service):
+        yield session, api, service
+
+
+# synthetic fixtures
+
+relevant = ["Aid convoys reached Idlib after the earthquake in north-west Syria.",
+            "The Syrian Arab Red Crescent says cross-border aid is still blocked by sanctions.",
+            "وصلت قافلة المساعدات إلى إدلب بعد الزلزال"]
+irrelevant = ["The central bank kept interest rates unchanged on Thursday.",
+              "The football season resumes next week after the winter break.",
+              "Markets closed higher as energy prices fell."]
+
+
+def synthetic_fixtures(path, sources, entries, accounts, tweets, relevant_rate=0.3, paragraphs=20, seed=0):
+    """
+    Fixtures for `sources` feeds of `entries` entries (with their articles) and `accounts` Twitter accounts
+    with `tweets` tweets each. Returns ({source name: feed url}, {account name: screen name}).
+    """
+    rng = random.Random(seed)
+    fixtures = Fixtures(path)
+    start = datetime.datetime(2023, 2, 6, tzinfo=datetime.timezone.utc)
+    feeds = {}
+    for i in range(sources):
+        feed_url = f"https://news{i}.example/rss"
+        feeds[f"Source {i}"] = feed_url
+        items = []
+        for j in range(entries):
+            link = f"https://news{i}.example/articles/{j}"
+            published = start + datetime.timedelta(minutes=10 * j)
+            about = rng.random() < relevant_rate
+            title = f"{'Earthquake in Syria' if about else 'Markets'}: update {j}"
+            items.append(f"<item><guid>{link}</guid><link>{link}</link><title>{title}</title>"
+                         f"<description>{rng.choice(relevant if about else irrelevant)}</description>"
+                         f"<pubDate>{published.strftime('%a, %d %b %Y %H:%M:%S +0000')}</pubDate></item>")
+            text = ''.join(f"<p>{rng.choice(relevant if about and k < 3 else irrelevant)} {i}-{j}-{k}</p>"
+                           for k in range(paragraphs))
+            fixtures.record_response(link, 200, {'Content-Type': 'text/html; charset=utf-8'},
+                                     f"<html><head><title>{title}</title></head><body>{text}</body></html>".encode())
+        rss = f"<rss version=\"2.0\"><channel><title>Source {i}</title>{''.join(items)}</channel></rss>"
+        fixtures.record_response(feed_url, 200, {'Content-Type': 'application/rss+xml', 'ETag': f'"feed-{i}"'},
+                                 rss.encode())
+    twitter = {}
+    for i in range(accounts):
+        screen_name = f"account{i}"
+        twitter[f"Account {i}"] = screen_name
+        fixtures.record_tweets(screen_name, [{
+            'id': 10 ** 18 + i * 10 ** 7 + j,
+            'created_at': (start + datetime.timedelta(minutes=5 * j)).strftime(tweet_time_format),
+            'full_text': rng.choice(relevant if rng.random() < relevant_rate else irrelevant),
+            'user': {'name': f"Account {i}", 'screen_name': screen_name},
+            'entities': {'hashtags': [], 'urls': [{'expanded_url': f"https://news.example/{i}/{j}"}]
+                         if rng.random() < 0.5 else []},
+            'geo': None, 'coordinates': None, 'place': None, 'retweet_count': rng.randrange(100),
+            'favorite_count': rng.randrange(100), 'possibly_sensitive': False, 'lang': 'en'
+        } for j in range(tweets)])
+    fixtures.record_rows('Articles', 1, [pipeline_module.article_columns])
+    fixtures.record_rows('Tweets', 1, [pipeline_module.tweet_columns])
+    fixtures.save()
+    return feeds, twitter
@@ -0,0 +1,87 @@
+"""
+Simulate the daemon's scheduler on a fake clock: synthetic sources publish at different rates (Poisson)
+and are polled by the real Scheduler/AdaptiveInterval, without any network or waiting.
+Run from the pipeline directory:  python benchmarks/simulate_daemon.py --days 7
+Reports, per source, the polls made, the average interval and how long new items waited to be picked up,
+next to a fixed interval polling every source as often as the busiest one needs.
+"""
+import random
+import argparse
+import bisect
+from datetime import datetime, timedelta, timezone
+from pipeline.daemon import AdaptiveInterval, FakeClock, InlineExecutor, Job, Scheduler
+
+epoch = datetime(2023, 2, 6, tzinfo=timezone.utc)
+# average items per hour
+rates = {'Al Jazeera': 12.0, 'Al Arabiya': 6.0, 'Middle East Monitor': 2.0, 'Enab Baladi': 1.0,
+         'Daily Sabah': 0.5, 'Kurdpress': 0.1}
+
+
+class SyntheticFeed:
+    """A feed publishing at `per_hour` on average, showing its latest `size` items."""
+
+    def __init__(self, per_hour, horizon, clock, rng, size=20):
+        self.clock = clock
+        self.size = size
+        self.times = []
+        t = 0.0
+        while t < horizon:
+            t += rng.expovariate(per_hour / 3600)
+            self.times.append(t)
+        self.seen = 0
+        self.polls = 0
+        self.waits = []
+
+    def poll(self):
+        self.polls += 1
+        now = self.clock()
+        published = bisect.bisect_right(self.times, now)
+        new = self.times[self.seen:published]
+        self.waits.extend(now - t for t in new)
+        self.seen = published
+        latest = self.times[max(published - self.size, 0):published]
+        return len(new), [epoch + timedelta(seconds=t) for t in latest]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--min-interval', type=float, default=60)
+    parser.add_argument('--max-interval', type=float, default=3600)
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    horizon = args.days * 24 * 3600
+    rng = random.Random(args.seed)
+    clock = FakeClock()
+    feeds = {name: SyntheticFeed(rate, horizon, clock, rng) for name, rate in rates.items()}
+    jobs = [Job(0.0, name, feed.poll, AdaptiveInterval(minimum=args.min_interval, maximum=args.max_interval))
+            for name, feed in feeds.items()]
+    scheduler = Scheduler(jobs, max_concurrency=args.max_concurrency, clock=clock, sleep=clock.sleep,
+                          executor=InlineExecutor(), rng=rng)
+    scheduler.run(until=horizon)
+    assert scheduler.max_running <= args.max_concurrency
+
+    # the fixed schedule that gives the busiest source the same average wait
+    busiest = max(rates, key=rates.get)
+    waits = feeds[busiest].waits
+    fixed_interval = 2 * sum(waits) / len(waits)
+    fixed_polls = len(feeds) * horizon / fixed_interval
+
+    print(f"{args.days:g} days, {len(feeds)} sources, {scheduler.max_running} polls at a time at most")
+    print(f"{'source':<22}{'items/h':>8}{'polls':>8}{'interval':>10}{'avg wait':>10}{'max wait':>10}")
+    for name, feed in feeds.items():
+        waits = feed.waits or [0.0]
+        print(f"{name:<22}{rates[name]:>8g}{feed.polls:>8}{horizon / feed.polls / 60:>9.0f}m"
+              f"{sum(waits) / len(waits) / 60:>9.1f}m{max(waits) / 60:>9.0f}m")
+    adaptive_polls = sum(feed.polls for feed in feeds.values())
+    print(f"adaptive: {adaptive_polls} polls; fixed every {fixed_interval / 60:.0f}m: {fixed_polls:.0f} polls "
+          f"({fixed_polls / adaptive_polls:.1f}x more)")
+
+    polls = {name: feed.polls for name, feed in feeds.items()}
+    assert polls['Al Jazeera'] > polls['Kurdpress'], "busy sources should be polled more often than quiet ones"
+
+
+if __name__ == "__main__":
+    main()
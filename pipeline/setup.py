@@ -29,6 +29,7 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             f"get-rss-feed = {PROJECT_NAME}.pipeline:main",
+            f"get-rss-feed-daemon = {PROJECT_NAME}.daemon:main",
         ]
     }
 )
\ No newline at end of file
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from pipeline.seen_index import normalize_url
+
+article_cache_file = "../data/articles.sqlite"
+
+
+class ArticleCache:
+    """
+    Persistent cache of downloaded articles, keyed by the hash of their normalized URL: the raw page
+    (compressed), the charset of the response and the paragraphs extracted from it. Entries older than
+    `ttl` seconds are not returned (unless `offline`, to re-scan articles without the network) and the
+    least recently used ones are evicted once the cache holds more than `max_bytes`.
+    """
+
+    def __init__(self, path=article_cache_file, max_bytes=1_000_000_000, ttl=30 * 24 * 3600, offline=False,
+                 clock=time.time):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # downloads run in threads, calls on the shared connection are serialized
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA mmap_size = 268435456;
+            CREATE TABLE IF NOT EXISTS articles (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                content BLOB NOT NULL,
+                encoding TEXT,
+                paragraphs BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS articles_last_used ON articles (last_used);
+        """)
+        if 'encoding' not in [column[1] for column in self.db.execute("PRAGMA table_info(articles)")]:
+            self.db.execute("ALTER TABLE articles ADD COLUMN encoding TEXT")  # caches of older versions
+        self.total = self.size()
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def get(self, url):
+        """(raw page, charset, paragraphs) of a cached article, or None."""
+        key = self.key(url)
+        with self._lock:
+            row = self.db.execute("SELECT content, encoding, paragraphs, fetched FROM articles WHERE key = ?",
+                                  (key,)).fetchone()
+            if row is None or (not self.offline and row[3] < self.clock() - self.ttl):
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute("UPDATE articles SET last_used = ? WHERE key = ?", (self.clock(), key))
+            self.hits += 1
+        content, encoding, paragraphs, _ = row
+        return zlib.decompress(content), encoding, json.loads(zlib.decompress(paragraphs))
+
+    def put(self, url, content, encoding, paragraphs):
+        key = self.key(url)
+        content = zlib.compress(content)
+        paragraphs = zlib.compress(json.dumps(paragraphs, ensure_ascii=False).encode())
+        size = len(key) + len(url) + len(content) + len(paragraphs)
+        now = self.clock()
+        with self._lock:
+            with self.db:
+                previous = self.db.execute("SELECT size FROM articles WHERE key = ?", (key,)).fetchone()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO articles "
+                    "(key, url, content, encoding, paragraphs, size, fetched, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (key, url, content, encoding, paragraphs, size, now, now))
+            self.total += size - (previous[0] if previous is not None else 0)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+
+    def evict(self):
+        # expired articles first, then the least recently used ones down to 90% of `max_bytes`,
+        # so that eviction does not run again on the next put
+        with self.db:
+            expired = self.db.execute("DELETE FROM articles WHERE fetched < ?", (self.clock() - self.ttl,)).rowcount
+        self.total = self.size()
+        excess = self.total - int(self.max_bytes * 0.9)
+        keys, freed = [], 0
+        if excess > 0:
+            for key, size in self.db.execute("SELECT key, size FROM articles ORDER BY last_used"):
+                keys.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            with self.db:
+                self.db.executemany("DELETE FROM articles WHERE key = ?", keys)
+            self.total -= freed
+        logging.info(f"Article cache: evicted {expired} expired and {len(keys)} least recently used articles, "
+                     f"{self.total} bytes left")
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
@@ -0,0 +1,94 @@
+import re
+import logging
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
+from lxml.etree import ParserError
+
+user_agent = "Mozilla/5.0 (compatible; get-rss-feed)"
+charset = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+header_charset = re.compile(r'charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+def make_session(per_host=4, retries=3, backoff=0.5):
+    """Session that keeps up to `per_host` connections open per host and retries with backoff."""
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET', 'HEAD'),
+                  raise_on_status=False, respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=per_host, max_retries=retry)
+    session = requests.Session()
+    session.headers['User-Agent'] = user_agent
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def response_encoding(headers):
+    """Charset of the Content-Type header of a response, None if it has none."""
+    match = header_charset.search(headers.get('Content-Type', ''))
+    return match.group(1) if match else None
+
+
+def extract_paragraphs(content, encoding=None):
+    """
+    Text of all <p> elements of an HTML page, decoded with `encoding` (the charset of the response) if
+    known, else with the page's <meta charset>, else as UTF-8 if it is valid UTF-8.
+    """
+    if not content:
+        return []
+    if encoding is None and not charset.search(content[:4096]):
+        try:
+            content.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            pass  # left to lxml (Latin-1)
+    try:
+        parser = lxml.html.HTMLParser(encoding=encoding) if encoding else None
+    except LookupError:  # unknown charset
+        parser = None
+    try:
+        doc = lxml.html.fromstring(content, parser=parser)
+    except (ParserError, ValueError):
+        return []
+    return [p.text_content() for p in doc.iter('p')]
+
+
+class ArticleDownloader:
+    """Download article pages concurrently, with at most `per_host` requests in flight per host."""
+
+    def __init__(self, session=None, max_workers=16, per_host=4, timeout=(5, 20)):
+        self.session = session if session is not None else make_session(per_host=per_host)
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.retries = 0
+
+    def _host_limit(self, url):
+        with self._lock:
+            return self._host_limits[urlsplit(url).netloc]
+
+    def fetch(self, url):
+        """(raw page content, charset of the response or None), or None if the page could not be downloaded."""
+        with self._host_limit(url):
+            try:
+                res = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                logging.warning(f"Could not download {url}: {e}")
+                return None
+        retries = getattr(getattr(res.raw, 'retries', None), 'history', ())
+        if retries:
+            with self._lock:
+                self.retries += len(retries)
+        if res.status_code != 200:
+            logging.warning(f"Could not download {url}: HTTP {res.status_code}")
+            return None
+        with self._lock:
+            self.nbytes += len(res.content)
+        return res.content, response_encoding(res.headers)
@@ -0,0 +1,248 @@
+"""
+Long-running mode: keeps the clients of the pipeline alive and polls every RSS feed and Twitter account
+at its own interval, following how often it publishes.
+"""
+import os
+import time
+import heapq
+import random
+import signal
+import threading
+import logging
+import functools
+import statistics
+import traceback
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pipeline.watermarks import as_utc
+from pipeline.metrics import run_report_file
+
+
+class AdaptiveInterval:
+    """
+    Polling interval of one source, in seconds. It moves towards `fraction` of the typical (median) gap
+    between the source's publications, and grows by `backoff` after every poll without anything new,
+    always between `minimum` and `maximum`.
+    """
+
+    def __init__(self, initial=600, minimum=60, maximum=3600, fraction=0.5, smoothing=0.3, backoff=1.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.fraction = fraction
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.value = min(max(initial, minimum), maximum)
+        self.last_published = None
+
+    def observe(self, new_items, published=()):
+        """Update the interval after a poll that found `new_items`, `published` are publication times."""
+        times = sorted(set(as_utc(timestamp) for timestamp in published))
+        if self.last_published is not None:
+            times = sorted(set(times) | {self.last_published})
+        gaps = [(later - earlier).total_seconds() for earlier, later in zip(times, times[1:])]
+        if gaps:
+            target = self.fraction * statistics.median(gaps)
+            self.value += self.smoothing * (target - self.value)
+        if times:
+            self.last_published = times[-1]
+        if not new_items:
+            self.value *= self.backoff
+        self.value = min(max(self.value, self.minimum), self.maximum)
+        return self.value
+
+
+@dataclass(order=True)
+class Job:
+    """A source to poll: `poll()` returns (number of new items, publication times), or None to keep the interval."""
+    due: float
+    name: str = field(compare=False)
+    poll: callable = field(compare=False)
+    interval: AdaptiveInterval = field(compare=False, default_factory=AdaptiveInterval)
+    polls: int = field(compare=False, default=0)
+    failures: int = field(compare=False, default=0)
+
+
+class Scheduler:
+    """
+    Runs every job when it is due, with at most `max_concurrency` polls at a time. After a poll the job
+    is due again after its (adaptive) interval, randomly stretched or shortened by up to `jitter`,
+    so that sources do not stay in lockstep.
+
+    `clock`, `sleep` and `executor` can be replaced, e.g. by a `FakeClock` and an `InlineExecutor`
+    to simulate days of polling in a fraction of a second.
+    """
+
+    def __init__(self, jobs=(), max_concurrency=4, jitter=0.1, clock=time.monotonic, sleep=None,
+                 executor=None, rng=None):
+        self.max_concurrency = max_concurrency
+        self.jitter = jitter
+        self.clock = clock
+        self._stop = threading.Event()
+        self.sleep = sleep if sleep is not None else self._stop.wait  # sleeping until due, or until `stop`
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_concurrency)
+        self.rng = rng if rng is not None else random.Random()
+        self.queue = []  # jobs waiting, as a heap on `due`
+        self.running = {}  # future -> job
+        self.max_running = 0
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        heapq.heappush(self.queue, job)
+
+    def stop(self, *args):
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def _reschedule(self, job, result):
+        if result is not None:
+            new_items, published = result
+            job.interval.observe(new_items, published)
+        delay = job.interval.value * (1 + self.rng.uniform(-self.jitter, self.jitter))
+        job.due = self.clock() + delay
+        self.add(job)
+        logging.debug(f"Next poll of {job.name} in {delay:.0f}s")
+
+    def _collect(self, done):
+        for future in done:
+            job = self.running.pop(future)
+            job.polls += 1
+            try:
+                result = future.result()
+            except Exception:
+                job.failures += 1
+                logging.exception(f"Poll of {job.name} failed")
+                result = (0, [])  # back off like after a poll without anything new
+            self._reschedule(job, result)
+
+    def run_pending(self):
+        """Start the jobs that are due, as long as there is room; returns the number started."""
+        started = 0
+        while self.queue and self.queue[0].due <= self.clock() and len(self.running) < self.max_concurrency:
+            job = heapq.heappop(self.queue)
+            self.running[self.executor.submit(job.poll)] = job
+            started += 1
+        self.max_running = max(self.max_running, len(self.running))
+        return started
+
+    def run(self, until=None):
+        """Poll until `stop` is called (or the clock passes `until`)."""
+        while not self.stopped and (until is None or self.clock() < until):
+            self.run_pending()
+            self._collect([future for future in self.running if future.done()])
+            if self.queue and self.queue[0].due <= self.clock() and len(self.running) < self.max_concurrency:
+                continue
+            delay = max(self.queue[0].due - self.clock(), 0) if self.queue else 1.0
+            if until is not None:
+                delay = min(delay, max(until - self.clock(), 0))
+            if self.running:
+                # wake up as soon as a poll finishes, it might free a slot for a job that is due
+                done, _ = wait(list(self.running), timeout=delay, return_when=FIRST_COMPLETED)
+                self._collect(done)
+            else:
+                self.sleep(delay)
+        wait(list(self.running))
+        self._collect(list(self.running))
+
+
+class FakeClock:
+    """Clock for simulations: `sleep` moves the time forward instead of waiting."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class InlineExecutor:
+    """Executor running every call as it is submitted, in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def poll_feed(pipeline, source_name, source_url):
+    try:
+        return pipeline.run_articles({source_name: source_url})[source_name]
+    except Exception:
+        pipeline.report.error(f"rss:{source_name}", traceback.format_exc())
+        raise
+
+
+def poll_account(pipeline, source_name, screen_name):
+    try:
+        return pipeline.run_tweets({source_name: screen_name})[source_name]
+    except Exception:
+        pipeline.report.error(f"twitter:{source_name}", traceback.format_exc())
+        raise
+
+
+def sync_index(pipeline):
+    with pipeline.report.timer('sync'):
+        pipeline.sync()
+    return None  # fixed interval
+
+
+def write_report(pipeline, path, prometheus_file=None):
+    # counters add up since the start of the daemon
+    pipeline.report.write_json(path)
+    if prometheus_file:
+        pipeline.report.write_prometheus(prometheus_file)
+    return None
+
+
+def make_jobs(pipeline, feeds, accounts, min_interval=60, max_interval=3600, sync_interval=900,
+              report_interval=300, report_file=run_report_file, prometheus_file=None, clock=time.monotonic):
+    now = clock()
+    jobs = []
+    for source_name, source_url in feeds.items():
+        jobs.append(Job(now, f"rss:{source_name}", functools.partial(poll_feed, pipeline, source_name, source_url),
+                        AdaptiveInterval(minimum=min_interval, maximum=max_interval)))
+    for source_name, screen_name in accounts.items():
+        jobs.append(Job(now, f"twitter:{source_name}",
+                        functools.partial(poll_account, pipeline, source_name, screen_name),
+                        AdaptiveInterval(minimum=min_interval, maximum=max_interval)))
+    # pick up the rows added to the sheet by others
+    jobs.append(Job(now + sync_interval, "sync", functools.partial(sync_index, pipeline),
+                    AdaptiveInterval(sync_interval, sync_interval, sync_interval)))
+    jobs.append(Job(now + report_interval, "report",
+                    functools.partial(write_report, pipeline, report_file, prometheus_file),
+                    AdaptiveInterval(report_interval, report_interval, report_interval)))
+    return jobs
+
+
+def main():
+    from pipeline.pipeline import Pipeline, sources, twitter_sources
+
+    pipeline = Pipeline()
+    pipeline.sync(rebuild=bool(os.environ.get('REBUILD_SEEN_INDEX')))
+    jobs = make_jobs(pipeline, sources, twitter_sources,
+                     min_interval=float(os.environ.get('DAEMON_MIN_INTERVAL', 60)),
+                     max_interval=float(os.environ.get('DAEMON_MAX_INTERVAL', 3600)),
+                     sync_interval=float(os.environ.get('DAEMON_SYNC_INTERVAL', 900)),
+                     report_file=os.environ.get('RUN_REPORT', run_report_file),
+                     prometheus_file=os.environ.get('PROMETHEUS_FILE'))
+    scheduler = Scheduler(jobs, max_concurrency=int(os.environ.get('DAEMON_MAX_CONCURRENCY', 4)))
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    logging.info(f"Polling {len(sources)} feeds and {len(twitter_sources)} accounts")
+    scheduler.run()
+    pipeline.close()
+    write_report(pipeline, os.environ.get('RUN_REPORT', run_report_file), os.environ.get('PROMETHEUS_FILE'))
+    logging.info("Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from dataclasses import dataclass, field
+import feedparser
+import requests
+from pipeline.stream import completed_map
+
+feed_state_file = "../data/feed_state.json"
+
+
+@dataclass
+class FeedResult:
+    source_name: str
+    url: str
+    entries: list = field(default_factory=list)
+    feed: dict = field(default_factory=dict)
+    status: int = None
+    not_modified: bool = False
+    etag: str = None
+    modified: str = None
+    latency: float = 0.0
+    nbytes: int = 0
+    error: str = None
+
+
+def parse_published(value):
+    """Publication date of an entry, keeping the timezone of the feed."""
+    try:
+        return parsedate_to_datetime(value)  # RSS (RFC 822)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))  # Atom (ISO 8601)
+    except ValueError:
+        pass
+    import pandas as pd
+    return pd.to_datetime(value).to_pydatetime()
+
+
+def load_feed_state(path=feed_state_file):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read feed state {path}, starting from scratch: {e}")
+        return {}
+
+
+def save_feed_state(results, path=feed_state_file, state=None):
+    # only persist validators of feeds that were actually fetched, so that a
+    # failed fetch keeps the previous ETag/Last-Modified
+    state = load_feed_state(path) if state is None else state
+    for result in results.values():
+        if result.error is not None or result.not_modified:
+            continue
+        state[result.source_name] = {'url': result.url, 'etag': result.etag, 'modified': result.modified}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def fetch_feed(source_name, source_url, cached=None, session=None, timeout=20):
+    result = FeedResult(source_name=source_name, url=source_url)
+    headers = {'User-Agent': feedparser.USER_AGENT}
+    # conditional GET, only valid if the source url did not change
+    if cached and cached.get('url') == source_url:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('modified'):
+            headers['If-Modified-Since'] = cached['modified']
+    get = session.get if session is not None else requests.get
+    start = time.perf_counter()
+    try:
+        res = get(source_url, headers=headers, timeout=timeout)
+        result.status = res.status_code
+        if res.status_code == 304:
+            result.not_modified = True
+            result.etag = (cached or {}).get('etag')
+            result.modified = (cached or {}).get('modified')
+        elif res.status_code == 200:
+            result.nbytes = len(res.content)
+            result.etag = res.headers.get('ETag')
+            result.modified = res.headers.get('Last-Modified')
+            parsed = feedparser.parse(res.content, response_headers={
+                'content-location': res.url,
+                'content-type': res.headers.get('Content-Type', '')
+            })
+            result.entries = parsed.entries
+            result.feed = parsed.feed
+        else:
+            result.error = f"HTTP {res.status_code}"
+    except requests.RequestException as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.latency = time.perf_counter() - start
+    return result
+
+
+def iter_feeds(sources, state=None, max_workers=8, timeout=20, session=None):
+    """Fetch the feeds in `sources` ({name: url}) concurrently, yielding every FeedResult as soon as it is fetched."""
+    state = load_feed_state() if state is None else state
+
+    def fetch(source):
+        source_name, source_url = source
+        return fetch_feed(source_name, source_url, state.get(source_name), session, timeout)
+
+    for _, result in completed_map(fetch, sources.items(), max_workers=max_workers):
+        yield result
+
+
+def log_feed_report(results):
+    hits = sum(result.not_modified for result in results.values())
+    logging.info(f"Fetched {len(results)} feeds, {hits} not modified (cache hits)")
+    for result in sorted(results.values(), key=lambda r: r.latency, reverse=True):
+        if result.error is not None:
+            outcome = f"error ({result.error})"
+        elif result.not_modified:
+            outcome = "not modified"
+        else:
+            outcome = f"{len(result.entries)} entries, {result.nbytes} bytes"
+        logging.info(f"  {result.source_name}: {result.latency:.2f}s, {outcome}")
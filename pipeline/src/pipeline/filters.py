@@ -0,0 +1,82 @@
+import re
+import logging
+from collections import Counter
+from pipeline.matcher import KeywordMatcher
+
+location_terms = ['syria', 'سوريا']
+location_matcher = KeywordMatcher(location_terms)
+
+# staging policies, deciding which entries get their full article downloaded
+#   'always':     download every entry, filter on the full text only
+#   'borderline': download if title/summary match the location or a keyword
+#   'strict':     download only if title/summary match both the location and a keyword
+policies = ('always', 'borderline', 'strict')
+default_policy = 'borderline'
+
+
+html_tag = re.compile(r"<[^>]*>")
+
+
+def clean_html(text):
+    return html_tag.sub("", text)
+
+
+def is_about_location(*texts):
+    return location_matcher.search(*texts)
+
+
+def prefilter(entry, keyword_matcher, translated=None):
+    """
+    Cheap check on title and summary, and on their English translation if in `translated`
+    ({text: translation}): 'pass', 'borderline' or 'reject'.
+    """
+    translated = translated or {}
+    title = clean_html(entry['title'])
+    titles = list(dict.fromkeys((title, translated.get(title, title))))
+    if 'summary' not in entry.keys():
+        # only the title to go on, let the full text decide
+        return 'pass' if is_about_location(*titles) and keyword_matcher.search(*titles) else 'borderline'
+    summary = clean_html(entry['summary'])
+    texts = titles + list(dict.fromkeys((summary, translated.get(summary, summary))))
+    location, relevant = is_about_location(*texts), keyword_matcher.search(*texts)
+    if location and relevant:
+        return 'pass'
+    if location or relevant:
+        return 'borderline'
+    return 'reject'
+
+
+def needs_download(verdict, policy=default_policy):
+    if policy not in policies:
+        raise ValueError(f"Unknown staging policy {policy}, should be one of {policies}")
+    if policy == 'always' or verdict == 'pass':
+        return True
+    return policy == 'borderline' and verdict == 'borderline'
+
+
+class StagedFilter:
+    """Decides per entry whether to download the full article and counts the downloads saved."""
+
+    def __init__(self, keyword_matcher, source_policies=None):
+        self.keyword_matcher = keyword_matcher
+        self.source_policies = source_policies or {}
+        self.downloads = Counter()
+        self.skipped = Counter()
+
+    def policy(self, source_name):
+        return self.source_policies.get(source_name, default_policy)
+
+    def __call__(self, source_name, entry, translated=None):
+        if needs_download(prefilter(entry, self.keyword_matcher, translated), self.policy(source_name)):
+            self.downloads[source_name] += 1
+            return True
+        self.skipped[source_name] += 1
+        return False
+
+    def log_report(self):
+        total = sum(self.downloads.values()) + sum(self.skipped.values())
+        logging.info(f"Staged filter: {sum(self.downloads.values())}/{total} articles downloaded, "
+                     f"{sum(self.skipped.values())} downloads saved")
+        for source_name in sorted(set(self.downloads) | set(self.skipped)):
+            logging.info(f"  {source_name} ({self.policy(source_name)}): {self.downloads[source_name]} downloaded, "
+                         f"{self.skipped[source_name]} skipped")
@@ -0,0 +1,72 @@
+import re
+
+# Arabic diacritics (tashkeel), superscript alef and tatweel are dropped,
+# letter variants are folded onto one form
+arabic_diacritics = re.compile('[ـً-ٰٟ]')
+arabic_variants = {'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي'}
+
+
+def normalize(text):
+    """Case- and Arabic-insensitive form of a text, used for both keywords and the texts to scan."""
+    text = text.casefold()
+    if text.isascii():
+        return text
+    text = arabic_diacritics.sub('', text)
+    for variant, letter in arabic_variants.items():
+        text = text.replace(variant, letter)
+    return text
+
+
+class KeywordMatcher:
+    """
+    Keyword matcher, built once from a list of keywords. Keywords are stripped, normalized (see `normalize`)
+    and deduplicated; each text is normalized once and then scanned for the compiled keyword set.
+    Matching is by substring, so 'quake' also matches 'earthquake'.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = {}  # normalized form -> first original keyword
+        for keyword in keywords:
+            key = normalize(keyword.strip())
+            if key and key not in self.keywords:
+                self.keywords[key] = keyword.strip()
+        # a keyword containing another one can only match if that one does, so checking
+        # whether anything matches only needs the keywords that contain no other keyword
+        self._minimal = [
+            key for key in sorted(self.keywords, key=len)
+            if not any(other != key and other in key for other in self.keywords)
+        ]
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def search(self, *texts):
+        """True if any keyword occurs in any of the texts."""
+        for text in texts:
+            if text:
+                text = normalize(text)
+                if any(key in text for key in self._minimal):
+                    return True
+        return False
+
+    def findall(self, *texts):
+        """Keywords (in their original form) occurring in any of the texts, in keyword order."""
+        texts = [normalize(text) for text in texts if text]
+        return [keyword for key, keyword in self.keywords.items() if any(key in text for text in texts)]
+
+    def merge(self, *matched):
+        """Keywords in any of the `findall` results `matched`, once and in keyword order."""
+        found = set().union(*matched)
+        return [keyword for keyword in self.keywords.values() if keyword in found]
+
+    def search_many(self, texts, normalized=False):
+        """`search` for every text, as a list of booleans; `normalized` if texts went through `normalize`."""
+        texts = texts if normalized else (normalize(text) for text in texts)
+        keys = self._minimal
+        return [any(key in text for key in keys) for text in texts]
+
+    def findall_many(self, texts, normalized=False):
+        """`findall` for every text in `texts`, as a list of lists."""
+        texts = texts if normalized else (normalize(text) for text in texts)
+        items = list(self.keywords.items())
+        return [[keyword for key, keyword in items if key in text] for text in texts]
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+
+run_report_file = "../data/run_report.json"
+profile_file = "../data/profile"
+
+
+class RunReport:
+    """
+    Counters and timings of a run, per stage and per source: wall time (`seconds`, summed over calls,
+    also when they overlap in threads), `calls`, `entries_in`, `entries_out`, `bytes`, `retries`, ...
+    and the number of entries rejected per reason. Thread-safe; written as JSON (`write_json`) or in
+    the Prometheus text format (`write_prometheus`, e.g. for the node exporter textfile collector).
+    """
+
+    def __init__(self, clock=time.time, max_errors=100):
+        self.clock = clock
+        self.started = clock()
+        self.finished = None
+        self.counters = defaultdict(Counter)  # (stage, source) -> {counter: value}
+        self.rejected = defaultdict(Counter)  # (stage, source) -> {reason: entries}
+        self.errors = deque(maxlen=max_errors)  # the latest ones, for a daemon running for weeks
+        self._lock = threading.Lock()
+
+    def count(self, stage, source=None, **counters):
+        with self._lock:
+            self.counters[stage, source].update({name: value for name, value in counters.items() if value})
+
+    def reject(self, stage, source=None, reason='rejected', entries=1):
+        if entries:
+            with self._lock:
+                self.rejected[stage, source][reason] += entries
+
+    @contextlib.contextmanager
+    def timer(self, stage, source=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(stage, source, calls=1, seconds=time.perf_counter() - start)
+
+    def error(self, stage, message):
+        with self._lock:
+            self.errors.append({'stage': stage, 'error': message})
+
+    def finish(self):
+        self.finished = self.clock()
+
+    def to_dict(self):
+        with self._lock:
+            keys = sorted(set(self.counters) | set(self.rejected), key=lambda key: (key[0], key[1] or ''))
+            stages = {}
+            for stage, source in keys:
+                stats = dict(self.counters[stage, source])
+                if self.rejected[stage, source]:
+                    stats['rejected'] = dict(self.rejected[stage, source])
+                report = stages.setdefault(stage, {'total': Counter(), 'rejected': Counter(), 'sources': {}})
+                report['total'].update(self.counters[stage, source])
+                report['rejected'].update(self.rejected[stage, source])
+                if source is not None:
+                    report['sources'][source] = stats
+            finished = self.finished if self.finished is not None else self.clock()
+            return {
+                'started': datetime.fromtimestamp(self.started, tz=timezone.utc).isoformat(),
+                'duration': finished - self.started,
+                'errors': list(self.errors),
+                'stages': {stage: {'total': {**report['total'], 'rejected': dict(report['rejected'])},
+                                   'sources': report['sources']}
+                           for stage, report in stages.items()}
+            }
+
+    def write_json(self, path=run_report_file):
+        write_atomic(path, json.dumps(self.to_dict(), indent=2, default=str))
+
+    def to_prometheus(self, prefix='get_rss_feed'):
+        report = self.to_dict()
+        lines = [f"# TYPE {prefix}_run_duration_seconds gauge",
+                 f"{prefix}_run_duration_seconds {report['duration']:.6g}",
+                 f"# TYPE {prefix}_run_errors gauge",
+                 f"{prefix}_run_errors {len(report['errors'])}"]
+        samples = defaultdict(list)
+        for stage, stage_report in report['stages'].items():
+            for source, stats in stage_report['sources'].items():
+                labels = {'stage': stage, 'source': source}
+                for name, value in stats.items():
+                    if name == 'rejected':
+                        for reason, entries in value.items():
+                            samples['rejected'].append(({**labels, 'reason': reason}, entries))
+                    else:
+                        samples[name].append((labels, value))
+            if not stage_report['sources']:
+                for name, value in stage_report['total'].items():
+                    if name != 'rejected':
+                        samples[name].append(({'stage': stage}, value))
+                for reason, entries in stage_report['total']['rejected'].items():
+                    samples['rejected'].append(({'stage': stage, 'reason': reason}, entries))
+        for name, values in samples.items():
+            metric = f"{prefix}_stage_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in values:
+                label_text = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{metric}{{{label_text}}} {value:.6g}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        write_atomic(path, self.to_prometheus())
+
+    def log_summary(self):
+        report = self.to_dict()
+        logging.info(f"Run report: {report['duration']:.1f}s, {len(report['errors'])} errors")
+        for stage, stage_report in report['stages'].items():
+            total = stage_report['total']
+            rejected = ', '.join(f"{reason} {entries}" for reason, entries in total['rejected'].items())
+            logging.info(f"  {stage}: "
+                         + (f"{total.get('seconds', 0):.2f}s in {total['calls']} calls, " if total.get('calls') else '')
+                         + f"{total.get('entries_in', 0)} in, {total.get('entries_out', 0)} out"
+                         + (f", {total['bytes']} bytes" if total.get('bytes') else '')
+                         + (f", {total['retries']} retries" if total.get('retries') else '')
+                         + (f" (rejected: {rejected})" if rejected else ''))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+@contextlib.contextmanager
+def profiled(profiler=None, path=profile_file):
+    """
+    Profile the body with `profiler` ('cprofile' or 'pyinstrument', nothing if None), saving the
+    profile next to `path` (profile.prof for snakeviz/pstats, profile.html for pyinstrument).
+    cProfile covers the calling thread and the threads started in the body (downloads, feeds,
+    daemon polls), pyinstrument only the calling thread. Worker processes are not profiled.
+    """
+    if not profiler:
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+        import io
+        # cProfile only sees the thread it is enabled in, every new thread gets a profiler of its own
+        profiles = [cProfile.Profile()]
+        lock = threading.Lock()
+
+        def profile_thread(*args):
+            thread_profile = cProfile.Profile()
+            try:
+                thread_profile.enable()
+            except ValueError:  # Python 3.12+, where the first profiler already sees every thread
+                return
+            with lock:
+                profiles.append(thread_profile)
+
+        profiles[0].enable()
+        threading.setprofile(profile_thread)
+        try:
+            yield
+        finally:
+            threading.setprofile(None)
+            profiles[0].disable()
+            stats = io.StringIO()
+            with lock:
+                profile = pstats.Stats(*profiles, stream=stats)
+            profile.dump_stats(path + '.prof')
+            profile.sort_stats('cumulative').print_stats(25)
+            logging.info(f"Profile of {len(profiles)} threads saved to {path}.prof, top functions:\n"
+                         f"{stats.getvalue()}")
+    elif profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(path + '.html', 'w') as f:
+                f.write(profile.output_html())
+            logging.info(f"Profile saved to {path}.html\n{profile.output_text(unicode=True)}")
+    else:
+        raise ValueError(f"Unknown profiler {profiler}, should be 'cprofile' or 'pyinstrument'")
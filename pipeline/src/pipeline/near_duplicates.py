@@ -0,0 +1,176 @@
+import os
+import re
+import zlib
+import sqlite3
+import hashlib
+import logging
+import numpy as np
+from pipeline.matcher import normalize
+
+near_duplicates_file = "../data/near_duplicates.sqlite"
+word = re.compile(r'\w+')
+
+
+def shingles(text, size=3):
+    """Set of the `size`-word sequences of a text (after `normalize`), as stable 64-bit hashes."""
+    words = word.findall(normalize(text))
+    hashes = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+    n = max(len(hashes) - size + 1, min(len(hashes), 1))  # texts shorter than `size` words are one shingle
+    grams = hashes[:n].copy()
+    for k in range(1, min(size, len(hashes))):
+        grams = grams * np.uint64(1000003) + hashes[k:k + n]  # wraps around, like any 64-bit hash
+    return np.unique(grams)
+
+
+class MinHash:
+    """
+    MinHash signatures of `num_perm` multiply-shift hash functions ((a * x + b) >> 32 on 64 bits),
+    the same across runs for a `seed`.
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)  # odd
+        self.b = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes):
+        if len(hashes) == 0:
+            return np.full(self.num_perm, 2 ** 32 - 1, dtype=np.uint32)
+        return ((np.outer(hashes, self.a) + self.b) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.mean(signature == other))
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash LSH index of the articles already saved, to recognize the same story published
+    by several sources (agency copy, light rewrites) even under different links.
+
+    A signature is split into `bands` of `num_perm / bands` values; documents sharing a band are
+    candidates, and a candidate of another source is a near duplicate if the estimated Jaccard similarity
+    of their word 3-grams is at least `threshold`. Documents of the same source are never near duplicates
+    of each other: the boilerplate of a site (footer, sidebar) can make up most of the text of its pages.
+    Every document joins the cluster of its closest near duplicate, or starts a new one.
+    """
+
+    def __init__(self, path=near_duplicates_file, num_perm=128, bands=16, threshold=0.7):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) should be a multiple of bands ({bands})")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.minhash = MinHash(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.db = sqlite3.connect(path, check_same_thread=False)  # shared by the daemon threads, one at a time
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                source TEXT,
+                cluster INTEGER NOT NULL,
+                duplicate_of TEXT,
+                signature BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_cluster ON documents (cluster);
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                hash INTEGER NOT NULL,
+                document INTEGER NOT NULL,
+                PRIMARY KEY (band, hash, document)
+            ) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def band_hashes(self, signature):
+        # one signed 64-bit hash per band, to be stored as an SQLite integer
+        return [int.from_bytes(hashlib.blake2b(signature[i * self.rows:(i + 1) * self.rows].tobytes(),
+                                               digest_size=8).digest(), 'big', signed=True)
+                for i in range(self.bands)]
+
+    def _candidates(self, band_hashes):
+        found = set()
+        for band, band_hash in enumerate(band_hashes):
+            found.update(document for document, in self.db.execute(
+                "SELECT document FROM bands WHERE band = ? AND hash = ?", (band, band_hash)))
+        return found
+
+    def query(self, text, source=None):
+        """
+        Closest near duplicate of `text` in the index, as (key, cluster, similarity), or None; if `source`
+        is given, among the documents of other sources.
+        """
+        hashes = shingles(text)
+        if not len(hashes):
+            return None
+        signature = self.minhash.signature(hashes)
+        return self._closest(signature, self.band_hashes(signature), source)
+
+    def _closest(self, signature, band_hashes, source=None):
+        candidates = list(self._candidates(band_hashes))
+        best = None
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            for key, cluster, blob in self.db.execute(
+                    f"SELECT key, cluster, signature FROM documents WHERE id IN ({', '.join('?' * len(chunk))}) "
+                    "AND (? IS NULL OR source IS NULL OR source != ?)", chunk + [source, source]):
+                score = similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+                if score >= self.threshold and (best is None or score > best[2]):
+                    best = (key, cluster, score)
+        return best
+
+    def add_many(self, documents):
+        """
+        Index `documents`, as (key, text, source), and return {key: key of the document it duplicates, or None}.
+        Keys that are already indexed keep their first answer, so re-adding a document never marks it as
+        a duplicate of itself.
+        """
+        documents = list(documents)
+        duplicates = {}
+        known = self._known([key for key, _, _ in documents])
+        with self.db:
+            for key, text, source in documents:
+                if key in known:
+                    duplicates[key] = known[key]
+                    continue
+                hashes = shingles(text)
+                signature = self.minhash.signature(hashes)
+                # documents without a single word are never near duplicates of each other
+                band_hashes = self.band_hashes(signature) if len(hashes) else []
+                closest = self._closest(signature, band_hashes, source)
+                duplicate_of = closest[0] if closest is not None else None
+                cursor = self.db.execute(
+                    "INSERT INTO documents (key, source, cluster, duplicate_of, signature) VALUES (?, ?, ?, ?, ?)",
+                    (key, source, closest[1] if closest is not None else -1, duplicate_of, signature.tobytes()))
+                document = cursor.lastrowid
+                if closest is None:  # first of its cluster
+                    self.db.execute("UPDATE documents SET cluster = ? WHERE id = ?", (document, document))
+                self.db.executemany("INSERT OR IGNORE INTO bands (band, hash, document) VALUES (?, ?, ?)",
+                                    [(band, band_hash, document) for band, band_hash in enumerate(band_hashes)])
+                duplicates[key] = known[key] = duplicate_of
+        found = sum(duplicate is not None for duplicate in duplicates.values())
+        if found:
+            logging.info(f"Near duplicates: {found}/{len(duplicates)} documents are near duplicates of indexed ones")
+        return duplicates
+
+    def _known(self, keys, chunk_size=500):
+        known = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            known.update(self.db.execute(
+                f"SELECT key, duplicate_of FROM documents WHERE key IN ({', '.join('?' * len(chunk))})", chunk))
+        return known
+
+    def cluster(self, key):
+        """Keys and sources of all the documents in the cluster of `key`."""
+        return self.db.execute(
+            "SELECT key, source FROM documents WHERE cluster = (SELECT cluster FROM documents WHERE key = ?) "
+            "ORDER BY id", (key,)).fetchall()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
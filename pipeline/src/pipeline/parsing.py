@@ -0,0 +1,135 @@
+"""
+CPU-bound work on the downloaded article pages (HTML parsing, keyword and location scan, language),
+in a pool of processes so that it is not limited to one core by the GIL. Workers get the raw page bytes
+and their charset, and send back a PageResult; the keyword matcher is built once per worker.
+"""
+import os
+import re
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from pipeline.articles import extract_paragraphs
+from pipeline.filters import location_matcher
+from pipeline.matcher import KeywordMatcher, normalize
+
+arabic_script = re.compile('[؀-ۿ]')
+persian_letters = set('پچژگکی')  # not used in Arabic, which has ك and ي
+turkish_letters = set('ğĞışŞİ')
+english_words = {'the', 'and', 'of', 'to', 'in', 'is', 'that', 'for', 'on', 'with', 'was', 'by', 'from'}
+
+
+class PageResult(NamedTuple):
+    paragraphs: list
+    keywords: list  # keywords occurring in the paragraphs, in keyword order
+    about_location: bool  # whether the paragraphs mention the location
+    language: str  # 'en', 'ar', 'fa', 'tr' or 'und', see detect_language
+    seconds: float  # time spent on the page
+
+
+def detect_language(text, sample=2000):
+    """Rough language of a text, from its script, letters and most common English words."""
+    sample = text[:sample]
+    letters = sum(c.isalpha() for c in sample)
+    if not letters:
+        return 'und'
+    arabic = len(arabic_script.findall(sample))
+    if arabic > letters / 2:
+        return 'fa' if sum(c in persian_letters for c in sample) > arabic / 50 else 'ar'
+    if sum(c in turkish_letters for c in sample) > letters / 200:
+        return 'tr'
+    words = sample.lower().split()
+    if sum(word in english_words for word in words) > len(words) / 20:
+        return 'en'
+    return 'und'
+
+
+def analyze(paragraphs, keyword_matcher, start=None):
+    start = time.perf_counter() if start is None else start
+    content = normalize(' '.join(paragraphs))
+    return PageResult(paragraphs=paragraphs,
+                      keywords=keyword_matcher.findall_many([content], normalized=True)[0],
+                      about_location=location_matcher.search_many([content], normalized=True)[0],
+                      language=detect_language(content),
+                      seconds=time.perf_counter() - start)
+
+
+_keyword_matcher = None
+
+
+def _init_worker(keywords):
+    global _keyword_matcher
+    _keyword_matcher = KeywordMatcher(keywords)
+
+
+def parse_page(content, encoding=None):
+    """PageResult of raw page bytes, in a worker process."""
+    start = time.perf_counter()
+    return analyze(extract_paragraphs(content, encoding), _keyword_matcher, start)
+
+
+class PageParser:
+    """
+    Parses pages in `workers` processes (PARSE_WORKERS, 1 by default), or in the calling thread if there
+    is only one: starting the processes costs more than they save on the pages of a one-shot run, so a
+    pool is for the daemon on a host with cores to spare. Processes are started on first use and kept
+    for the next polls.
+    """
+
+    def __init__(self, keywords, workers=None, window=None):
+        self.keywords = list(keywords)
+        self.keyword_matcher = KeywordMatcher(self.keywords)
+        self.workers = workers if workers is not None else int(os.environ.get('PARSE_WORKERS') or 1)
+        self.window = window or 4 * self.workers
+        self._executor = None
+        self._lock = threading.Lock()  # daemon polls share the parser, only one of them starts the pool
+
+    @property
+    def executor(self):
+        if self.workers <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked, a fork could copy locks held by the download threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_worker, initargs=(self.keywords,))
+            return self._executor
+
+    def parse(self, content, encoding=None):
+        start = time.perf_counter()
+        return analyze(extract_paragraphs(content, encoding), self.keyword_matcher, start)
+
+    def map(self, items):
+        """
+        (item, page, PageResult or None) for every (item, page), in order, a page being (content, charset,
+        paragraphs or None) or None if it could not be downloaded.
+        Pages with paragraphs (e.g. from the article cache) are only scanned, in the calling thread.
+        """
+        pending = deque()
+        for item, page in items:
+            if page is None:
+                pending.append((item, page, lambda: None))
+            elif page[2] is not None:
+                pending.append((item, page, lambda result=self.analyze(page[2]): result))
+            elif self.executor is None:
+                pending.append((item, page, lambda result=self.parse(page[0], page[1]): result))
+            else:
+                pending.append((item, page, self.executor.submit(parse_page, page[0], page[1]).result))
+            if len(pending) >= self.window:
+                item, page, result = pending.popleft()
+                yield item, page, result()
+        while pending:
+            item, page, result = pending.popleft()
+            yield item, page, result()
+
+    def analyze(self, paragraphs):
+        return analyze(paragraphs, self.keyword_matcher)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
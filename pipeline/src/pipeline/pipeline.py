@@ -1,16 +1,5 @@
 import os.path
-import feedparser
-from google.cloud import translate_v2 as google_translate
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-# from transformers import pipeline
-import ast
-import numpy as np
-import tweepy
-import pandas as pd
-from tqdm import tqdm
-import re
-from time import sleep
+import functools
 import json
 from dotenv import load_dotenv
 credentials_path = '../credentials'
@@ -19,8 +8,19 @@ if os.path.exists(f"{credentials_path}/.env"):
 import traceback
 import sys
 import logging
-from bs4 import BeautifulSoup
+import threading
+from collections import Counter
+from datetime import datetime, timezone
 import requests
+from pipeline.feeds import iter_feeds, save_feed_state, log_feed_report, parse_published
+from pipeline.filters import StagedFilter, clean_html, is_about_location, location_matcher
+from pipeline.matcher import KeywordMatcher, normalize
+from pipeline.sinks import SheetsSink, SQLiteSink, ParquetSink, MultiSink
+from pipeline.stream import buffered, chunked, ordered_map
+from pipeline.metrics import RunReport, profiled, run_report_file
+from pipeline.seen_index import SeenIndex, normalize_url, article_keys, tweet_keys
+from pipeline.watermarks import WatermarkStore
+from pipeline.translation import Translator, TranslationCache, GoogleTranslateBackend
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -35,291 +35,654 @@ logging.getLogger("azure").setLevel(logging.WARNING)
 logging.getLogger("requests_oauthlib").setLevel(logging.WARNING)
 
 
-def get_url_from_entities(entities):
-    try:
-        return entities['urls'][0]['expanded_url']
-    except:
-        return np.nan
+# heavy clients are only created (and their libraries imported) once a stage needs them,
+# and are then kept for the lifetime of the process
 
 
-def get_url_from_tweet(row):
-    return f"https://twitter.com/{row['screen_name']}/status/{row['id']}"
+@functools.lru_cache(maxsize=None)
+def get_credentials():
+    from google.oauth2 import service_account
+    scopes = [
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/cloud-translation'
+    ]
+    service_account_info = json.load(open(f"{credentials_path}/google-service-account-template.json"))
+    service_account_info['private_key_id'] = os.environ['PRIVATE_KEY_ID']
+    service_account_info['private_key'] = os.environ['PRIVATE_KEY'].replace(r'\n', '\n')
+    service_account_info['client_id'] = os.environ['CLIENT_ID']
+    return service_account.Credentials.from_service_account_info(service_account_info, scopes=scopes)
 
 
-def format_df(df_tweets):
-    df_tweets['user'] = df_tweets['user'].astype(str).apply(ast.literal_eval)
-    df_tweets['source'] = df_tweets['user'].apply(lambda x: x['name'])
-    df_tweets['screen_name'] = df_tweets['user'].apply(lambda x: x['screen_name'])
-    df_tweets['entities'] = df_tweets['entities'].astype(str).apply(ast.literal_eval)
-    df_tweets['url'] = df_tweets['entities'].apply(get_url_from_entities)
-    df_tweets['twitter_url'] = df_tweets.apply(get_url_from_tweet, axis=1)
-    df_tweets['url'] = df_tweets['url'].fillna(df_tweets['twitter_url'])
-    df_tweets['created_at'] = pd.to_datetime(df_tweets['created_at'])
-    df_tweets['created_at'] = df_tweets['created_at'].dt.tz_localize(None)
-    df_tweets = df_tweets[['created_at', 'id', 'full_text', 'source', 'geo', 'coordinates', 'place', 'retweet_count',
-                           'favorite_count', 'possibly_sensitive', 'lang', 'url']]
-    return df_tweets
+@functools.lru_cache(maxsize=None)
+def get_sheets_service():
+    from googleapiclient.discovery import build
+    return build('sheets', 'v4', credentials=get_credentials())
 
 
-def main():
+@functools.lru_cache(maxsize=None)
+def get_translator():
+    from google.cloud import translate_v2 as google_translate
+    # translator = pipeline("translation_tr_to_en", model=f"Helsinki-NLP/opus-mt-tr-en")
+    return Translator(GoogleTranslateBackend(google_translate.Client(credentials=get_credentials())),
+                      TranslationCache())
 
-    import datetime
-    utc_timestamp = (
-        datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
-    )
-
-    try:
-        # initialize google sheets api
-        SCOPES = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/cloud-translation'
-        ]
-        spreadsheet_id = '1p8zMlaXlC-3BpPbl5Yb61u6VZRUIxD1Gc2yo7PJ9ScY'
-        spreadsheet_range = 'Articles!A:G'
-        service_account_info = json.load(open(f"{credentials_path}/google-service-account-template.json"))
-        service_account_info['private_key_id'] = os.environ['PRIVATE_KEY_ID']
-        service_account_info['private_key'] = os.environ['PRIVATE_KEY'].replace(r'\n', '\n')
-        service_account_info['client_id'] = os.environ['CLIENT_ID']
-        creds = service_account.Credentials.from_service_account_info(service_account_info, scopes=SCOPES)
-        service = build('sheets', 'v4', credentials=creds)
-
-        # initialize the translator
-        translator = google_translate.Client(credentials=creds)
-        # translator = pipeline("translation_tr_to_en", model=f"Helsinki-NLP/opus-mt-tr-en")
-
-        # get data already in the spreadsheet
-        result = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
-                                                     range=spreadsheet_range).execute()
-        values = result.get('values', [])
-        df_old_values = pd.DataFrame.from_records(values[1:], columns=values[0])
-        df_old_values['datetime'] = pd.to_datetime(
-            df_old_values['Date'].astype(str) + ' ' + df_old_values['Time'].astype(str),
-            format="%d/%m/%Y %H:%M"
-        )
-
-        # data sources
-        sources = {
-            'Alahednews': 'https://www.alahednews.com.lb/rss/',
-            'Enab Baladi': 'https://www.enabbaladi.net/feed',
-            'Daily Sabah': 'https://www.dailysabah.com/rssFeed/home-page',
-            'Kurdpress': 'https://kurdpress.com/rss.php?lang=fa&cat=10',
-            'Al Jazeera': 'https://www.aljazeera.com/xml/rss/all.xml',
-            'Al Arabiya': 'https://www.alarabiya.net/feed/rss2/ar.xml',
-            'Middle East Monitor': 'https://www.middleeastmonitor.com/feed/'
-        }
-
-        english_query = ["Syrian Arab Red Crescent", "Syrian Red Crescent", "Khaled Hboubati", "Khaled Erksoussi",
-                         "Hossam Elsharkawi", "Mey Al Sayegh", "Idlib", "Idleb", "Safe access", "sanctions",
-                         "cross-border aid", "crossline operations", "cholera", "north-west Syria", "northwest Syria",
-                         "quake", "earthquake"]
-        arabic_query = ["إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود", "العمليات عبر الحدود", "الكوليرا",
-                        "شمالي غربي سوريا", "إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود",
-                        "العمليات عبر الحدود", "الكوليرا", "هزة أرضية", "شمالي غربي سوريا"]
-        keywords = english_query + arabic_query
 
-        entries = []
+@functools.lru_cache(maxsize=None)
+def get_twitter_api():
+    import tweepy
+    auth = tweepy.OAuthHandler(os.environ['TWITTER_API_KEY'], os.environ['TWITTER_API_SECRET'])
+    auth.set_access_token(os.environ['TWITTER_ACCESS_TOKEN'], os.environ['TWITTER_ACCESS_SECRET'])
+    return tweepy.API(auth, wait_on_rate_limit=True)
 
-        for source_name, source_url in sources.items():
-            logging.info(f'Start source {source_name}')
-            # get news feed
-            NewsFeed = feedparser.parse(source_url)
 
-            for entry in NewsFeed.entries:
-                if any(x not in entry.keys() for x in ['id', 'published', 'link', 'title']):
-                    continue
+# columns of the Articles and Tweets sheets
+article_columns = ['Date', 'Time', 'Title', 'Content', 'Source', 'Source+datetime', 'Link', 'Keywords']
+tweet_columns = ['created_at', 'id', 'full_text', 'source', 'geo', 'coordinates', 'place', 'retweet_count',
+                 'favorite_count', 'possibly_sensitive', 'lang', 'url', 'keywords']
+tweet_time_format = '%a %b %d %H:%M:%S %z %Y'
+
+
+def format_df(tweets):
+    # tweets (as tweet dicts) to the columns of the Tweets sheet
+    import pandas as pd
+    df_tweets = pd.DataFrame.from_records(tweets)
+    df_tweets['source'] = df_tweets['user'].str.get('name')
+    df_tweets['screen_name'] = df_tweets['user'].str.get('screen_name')
+    # (as object, in case none of the tweets has a url)
+    df_tweets['url'] = df_tweets['entities'].str.get('urls').str.get(0).astype(object).str.get('expanded_url')
+    df_tweets['twitter_url'] = ('https://twitter.com/' + df_tweets['screen_name'] + '/status/' +
+                                df_tweets['id'].astype(str))
+    df_tweets['url'] = df_tweets['url'].fillna(df_tweets['twitter_url'])
+    df_tweets['created_at'] = pd.to_datetime(df_tweets['created_at'], format=tweet_time_format)
+    df_tweets['created_at'] = df_tweets['created_at'].dt.tz_localize(None)
+    df_tweets = df_tweets.reindex(columns=tweet_columns[:-1])  # keywords are added by filter_tweets
+    return df_tweets
 
-                datetime_entry = pd.to_datetime(entry['published'])
 
-                if not df_old_values.empty:
+def filter_tweets(df_tweets, keyword_matcher, seen_index, since='2023-02-06', rejected=None):
+    # `rejected` (a Counter) gets the number of tweets dropped per reason
+    import pandas as pd
+    rejected = rejected if rejected is not None else Counter()
+    # drop old tweets
+    n_tweets = len(df_tweets)
+    df_tweets = df_tweets[df_tweets['created_at'] >= pd.Timestamp(since)]
+    rejected['too_old'] += n_tweets - len(df_tweets)
+    # filter by location and keyword, normalizing every text only once
+    texts = [normalize(text) for text in df_tweets['full_text'].fillna('')]
+    about_location = location_matcher.search_many(texts, normalized=True)
+    texts = [text for text, keep in zip(texts, about_location) if keep]
+    df_tweets = df_tweets[about_location]
+    rejected['not_about_location'] += len(about_location) - len(df_tweets)
+    df_tweets = df_tweets.assign(keywords=[', '.join(matched) for matched in
+                                           keyword_matcher.findall_many(texts, normalized=True)])
+    n_tweets = len(df_tweets)
+    df_tweets = df_tweets[df_tweets['keywords'] != '']
+    rejected['no_keyword'] += n_tweets - len(df_tweets)
+    # skip if link already present in google sheet
+    urls = df_tweets['url'].map(normalize_url)
+    seen = urls.isin(seen_index.seen_many('tweet_url', urls))
+    rejected['seen'] += int(seen.sum())
+    return df_tweets[~seen]
+
+
+# Google sheet
+spreadsheet_id = '1p8zMlaXlC-3BpPbl5Yb61u6VZRUIxD1Gc2yo7PJ9ScY'
+articles_range = 'Articles!A:H'
+tweets_range = 'Tweets!A:M'
+
+# local outputs, next to (or instead of) the sheet, see `Pipeline.make_sink`
+output_sqlite_file = "../data/output.sqlite"
+output_parquet_path = "../data/parquet"
+article_fields = {'link': 'text', 'source': 'text', 'datetime': 'timestamp', 'title': 'text', 'content': 'text',
+                  'keywords': 'text'}
+tweet_fields = {'id': 'integer', 'url': 'text', 'source': 'text', 'datetime': 'timestamp', 'full_text': 'text',
+                'lang': 'text', 'retweet_count': 'integer', 'favorite_count': 'integer', 'keywords': 'text'}
+
+
+def article_record(entry):
+    return {'link': entry['Link'], 'source': entry['Source'], 'datetime': entry['datetime'], 'title': entry['Title'],
+            'content': entry['Content'], 'keywords': entry['Keywords']}
+
+
+def tweet_record(row):
+    def integer(value):
+        return int(value) if value != '' else None
+    return {'id': int(row['id']), 'url': row['url'], 'source': row['source'],
+            'datetime': datetime.fromisoformat(row['created_at']).replace(tzinfo=timezone.utc),
+            'full_text': row['full_text'], 'lang': row['lang'], 'retweet_count': integer(row['retweet_count']),
+            'favorite_count': integer(row['favorite_count']), 'keywords': row['keywords']}
+
+
+def month_partition(record):
+    return {'month': record['datetime'].strftime('%Y-%m') if record['datetime'] is not None else 'unknown'}
+
+
+# data sources
+sources = {
+    'Alahednews': 'https://www.alahednews.com.lb/rss/',
+    'Enab Baladi': 'https://www.enabbaladi.net/feed',
+    'Daily Sabah': 'https://www.dailysabah.com/rssFeed/home-page',
+    'Kurdpress': 'https://kurdpress.com/rss.php?lang=fa&cat=10',
+    'Al Jazeera': 'https://www.aljazeera.com/xml/rss/all.xml',
+    'Al Arabiya': 'https://www.alarabiya.net/feed/rss2/ar.xml',
+    'Middle East Monitor': 'https://www.middleeastmonitor.com/feed/'
+}
+# which entries to download the full article for, based on title and summary (see filters.py)
+source_policies = {
+    'Al Jazeera': 'strict',
+    'Daily Sabah': 'strict'
+}
+twitter_sources = {
+    'SANA Syria': 'SANAEnOfficial',
+    'Alwatan Syria': 'AlwatanSy',
+    'HashtagSyria': 'presshashtag',
+    'Almasdar Online': 'AlmasdaronlineE',
+    'Alghad': 'AlghadNews',
+    'Shaam': 'ShaamNetwork',
+    'Syrian Observatory for Human Rights': 'syriahr',
+    'Baladi News': 'baladinetwork',
+    'North Press Agency': 'NPA_Arabic',
+    'Sky News Arabia': 'skynewsarabia',
+    'Al Maydeen': 'Almayadeennews',
+    'Monte Carlo Doualiya': 'MC_Doualiya',
+    'BBC Arabic': 'BBCArabic'
+}
+twitter_data_path = "../data"
+
+english_query = ["Syrian Arab Red Crescent", "Syrian Red Crescent", "Khaled Hboubati", "Khaled Erksoussi",
+                 "Hossam Elsharkawi", "Mey Al Sayegh", "Idlib", "Idleb", "Safe access", "sanctions",
+                 "cross-border aid", "crossline operations", "cholera", "north-west Syria", "northwest Syria",
+                 "quake", "earthquake"]
+arabic_query = ["إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود", "العمليات عبر الحدود", "الكوليرا",
+                "شمالي غربي سوريا", "إدلب", "العبور الآمن", " عقوبات", "مساعدات عبر الحدود",
+                "العمليات عبر الحدود", "الكوليرا", "هزة أرضية", "شمالي غربي سوريا"]
+
+
+class Pipeline:
+    """
+    Clients and local state (seen index, watermarks, tweet store, sinks) shared by all the polls
+    of a process: one pass of `main`, or every poll of the daemon (see daemon.py).
+
+    A poll is a chain of generators, fetch -> parse -> dedup -> filter -> enrich -> sink, each holding
+    a bounded number of items, so rows are written while other sources are still being fetched and
+    memory does not grow with the number of entries. Entries are only ordered within a source.
+
+    Polls may run in several threads: network calls (feeds, articles, tweets) run concurrently,
+    everything that reads or writes local state or the sheet runs under `lock`.
+
+    Every stage adds its timings and counters, per source, to `report` (see metrics.py).
+    """
+
+    def __init__(self, service=None, seen_index=None, translate_batch=64, report=None):
+        self.service = service if service is not None else get_sheets_service()
+        self.seen_index = seen_index if seen_index is not None else SeenIndex()
+        self.keyword_matcher = KeywordMatcher(english_query + arabic_query)
+        self.staged_filter = StagedFilter(self.keyword_matcher, source_policies)
+        self.translate_batch = translate_batch
+        self.feed_session = requests.Session()
+        self.watermarks = WatermarkStore()
+        self.sinks = {}
+        self.pending_links = set()  # links of the rows in the sink, not in the seen index yet
+        self.lock = threading.RLock()
+        self.report = report if report is not None else RunReport()
+
+    @functools.cached_property
+    def downloader(self):
+        from pipeline.articles import ArticleDownloader
+        return ArticleDownloader()
+
+    @functools.cached_property
+    def article_cache(self):
+        # ARTICLES_OFFLINE=1 to re-run (e.g. with new keywords) on the cached articles only, without downloading
+        from pipeline.article_cache import ArticleCache
+        return ArticleCache(offline=bool(os.environ.get('ARTICLES_OFFLINE')))
+
+    @functools.cached_property
+    def page_parser(self):
+        from pipeline.parsing import PageParser
+        return PageParser(english_query + arabic_query)
+
+    @functools.cached_property
+    def near_duplicates(self):
+        from pipeline.near_duplicates import NearDuplicateIndex
+        return NearDuplicateIndex()
+
+    @functools.cached_property
+    def tweet_store(self):
+        from pipeline.tweets import TweetStore
+        return TweetStore()
+
+    def sync(self, rebuild=False):
+        """Sync the local index of data already in the spreadsheet (`rebuild` re-reads the whole sheet)."""
+        with self.lock:
+            for sink in self.sinks.values():
+                sink.flush()
+            sync = self.seen_index.rebuild if rebuild else self.seen_index.sync
+            article_rows = sync(self.service, spreadsheet_id, articles_range, article_keys)
+            tweet_rows = sync(self.service, spreadsheet_id, tweets_range, tweet_keys)
+            self.watermarks = WatermarkStore.from_index(self.seen_index)
+            if self.sinks:
+                # polls running in other threads hold on to the sinks, only move where they append
+                for sheet, rows in (('Articles', article_rows), ('Tweets', tweet_rows)):
+                    for output in getattr(self.sinks[sheet], 'sinks', [self.sinks[sheet]]):
+                        if isinstance(output, SheetsSink):
+                            output.next_row = rows + 1
+                return
+            self.sinks = {
+                'Articles': self.make_sink(
+                    SheetsSink(self.service, spreadsheet_id, articles_range, start_row=article_rows,
+                               key_column=article_columns.index('Link'),
+                               to_values=lambda entry: [entry[column] for column in article_columns]),
+                    'articles', article_fields, article_record, key='link', on_write=self.articles_written),
+                'Tweets': self.make_sink(
+                    SheetsSink(self.service, spreadsheet_id, tweets_range, start_row=tweet_rows,
+                               key_column=tweet_columns.index('url'),
+                               to_values=lambda row: [row[column] for column in tweet_columns]),
+                    'tweets', tweet_fields, tweet_record, key='id', on_write=self.tweets_written)
+            }
+
+    def close(self):
+        """Write what is pending and close the sinks (logging the rows written per second), at the end of a run."""
+        with self.lock:
+            sinks, self.sinks = self.sinks, {}
+            for sink in sinks.values():
+                sink.close()
+
+    @staticmethod
+    def make_sink(sheets_sink, dataset, fields, to_record, key, on_write):
+        """
+        Sink of a dataset, writing to the outputs listed in SINKS (comma-separated, default 'sheets'):
+        'sheets', 'sqlite' (table `dataset` of output.sqlite, indexed on link/url, source and datetime)
+        and 'parquet' (`dataset` directory partitioned by month). Rows count as saved, `on_write`,
+        once they are in all of them.
+        """
+        sinks = []
+        for name in os.environ.get('SINKS', 'sheets').split(','):
+            name = name.strip()
+            if name == 'sheets':
+                sinks.append(sheets_sink)
+            elif name == 'sqlite':
+                sinks.append(SQLiteSink(output_sqlite_file, dataset, fields, key=key, to_record=to_record,
+                                        indexes=[field for field in ('link', 'url', 'source', 'datetime')
+                                                 if field in fields and field != key]))
+            elif name == 'parquet':
+                sinks.append(ParquetSink(f"{output_parquet_path}/{dataset}", fields, partition_by=month_partition,
+                                         to_record=to_record))
+            elif name:
+                raise ValueError(f"Unknown sink {name}, should be 'sheets', 'sqlite' or 'parquet'")
+        if not sinks:
+            raise ValueError("SINKS should list at least one of 'sheets', 'sqlite' or 'parquet'")
+        if len(sinks) == 1:
+            sinks[0].on_write = on_write
+            return sinks[0]
+        return MultiSink(sinks, on_write=on_write)
+
+    def articles_written(self, entries):
+        self.seen_index.add_many((key for entry in entries for key in article_keys(entry)), sheet='Articles')
+        for entry in entries:
+            self.watermarks.update(entry['Source'], entry['datetime'])
+            self.pending_links.discard(normalize_url(entry['Link']))
+
+    def tweets_written(self, rows):
+        self.seen_index.add_many((key for row in rows for key in tweet_keys(row)), sheet='Tweets')
+
+    def run_articles(self, sources):
+        """
+        Poll the RSS feeds in `sources` ({name: url}) and add the new relevant articles to the sheet.
+        Returns {name: (number of new entries, publication times of the entries in the feed)}.
+        """
+        polled = {source_name: (0, []) for source_name in sources}
+        feeds = {}
+        # feeds that did not change since the last run are skipped, except offline (ARTICLES_OFFLINE) where
+        # they are fetched in full to re-scan the cached articles of all their entries
+        state = {} if self.article_cache.offline else None
+        candidates = self.new_entries(iter_feeds(sources, state=state, session=self.feed_session), feeds, polled)
+        # download the candidate articles, a bounded number at a time, and parse them in other processes
+        downloads = ordered_map(self.fetch_article, candidates, max_workers=self.downloader.max_workers)
+        pages = self.parse_articles(downloads)
+        sink = self.sinks['Articles']
+        sink_stats = self.sink_stats(sink)
+        retries = self.downloader.retries
+        for chunk in chunked(pages, self.translate_batch):
+            entries = self.select_articles(chunk)
+            with self.lock:
+                # the same story published by another source (under another link) joins its cluster
+                duplicates = self.near_duplicates.add_many(
+                    (normalize_url(entry['Link']), f"{entry['Title']} {entry['Content']}", entry['Source'])
+                    for entry in entries)
+                for entry in entries:
+                    link = normalize_url(entry['Link'])
+                    self.report.count('near_duplicates', entry['Source'], entries_in=1)
+                    if duplicates[link] is not None:
+                        logging.info(f"{entry['Link']} is a near duplicate of {duplicates[link]}, skipping")
+                        self.report.reject('near_duplicates', entry['Source'], 'near_duplicate')
+                        # seen, but in no sheet, so that it is not downloaded again
+                        self.seen_index.add_many(article_keys(entry))
+                        continue
+                    # skip entries already on their way to the sheet (same link in two feeds)
+                    if link in self.pending_links:
+                        self.report.reject('near_duplicates', entry['Source'], 'same_link')
+                        continue
+                    self.pending_links.add(link)
+                    self.report.count('near_duplicates', entry['Source'], entries_out=1)
+                    sink.add(entry)
+
+        with self.lock:
+            sink.flush()
+            self.record_sink('Articles', sink, sink_stats)
+            self.report.count('article_download', retries=self.downloader.retries - retries)
+            log_feed_report(feeds)
+            self.staged_filter.log_report()
+            # remember ETag/Last-Modified only once the new entries are saved
+            save_feed_state(feeds)
+        return polled
+
+    def new_entries(self, feeds, fetched, polled):
+        """(source, entry, published) for the entries that are new and worth downloading, oldest first per feed."""
+        report = self.report
+        for feed in feeds:
+            source_name = feed.source_name
+            logging.info(f'Start source {source_name}')
+            entries, feed.entries = feed.entries, []  # only the validators are kept until the end of the poll
+            fetched[source_name] = feed
+            report.count('feed_fetch', source_name, calls=1, seconds=feed.latency, bytes=feed.nbytes,
+                         entries_out=len(entries), not_modified=int(feed.not_modified),
+                         errors=int(feed.error is not None))
+            if feed.error is not None:
+                logging.warning(f"Could not fetch {source_name}: {feed.error}")
+                continue
+            with report.timer('feed_parse', source_name):
+                n_entries = len(entries)
+                entries = [(entry, parse_published(entry['published'])) for entry in entries
+                           if all(x in entry.keys() for x in ['id', 'published', 'link', 'title'])]
+                # the entries of one feed are the merge buffer that puts that source in chronological order
+                entries.sort(key=lambda item: item[1])
+            report.count('feed_parse', source_name, entries_in=n_entries, entries_out=len(entries))
+            report.reject('feed_parse', source_name, 'missing_fields', n_entries - len(entries))
+            polled[source_name] = (0, [datetime_entry for _, datetime_entry in entries])
+            # skip the whole feed if it was not updated since the latest news
+            offline = self.article_cache.offline
+            if not offline and self.watermarks.feed_is_stale(source_name, feed.feed):
+                report.reject('dedup', source_name, 'feed_not_updated', len(entries))
+                continue
+
+            new_entries = []
+            with self.lock, report.timer('dedup', source_name):
+                for entry, datetime_entry in entries:
                     # skip if link already present in google sheet
-                    if entry['link'] in df_old_values['Link'].unique():
+                    if self.seen_index.seen('article', normalize_url(entry['link'])):
+                        report.reject('dedup', source_name, 'seen')
                         continue
                     # skip if older than latest news
-                    if datetime_entry < df_old_values[df_old_values['Source'] == source_name]['datetime'].max().tz_localize(
-                            'UTC+03:00'):
-                        print(f"{datetime_entry} is older than {df_old_values['datetime'].max()}, skipping")
+                    if not offline and self.watermarks.is_older(source_name, datetime_entry):
+                        print(f"{datetime_entry} is older than {self.watermarks.get(source_name)}, skipping")
+                        report.reject('dedup', source_name, 'older_than_watermark')
                         continue
-                    else:
-                        print(f"{datetime_entry} is newer than {df_old_values['datetime'].max()}, saving")
-
-                title = re.sub(r"<(.*)>", "", entry['title'])  # clean title (without HTML leftovers)
-                title_en = title  # translator.translate(title, target_language="en")["translatedText"]  # translate title to english
-
-                res = requests.get(entry['id'])
-                if res.status_code == 200:
-                    soup = BeautifulSoup(res.content, 'html.parser')
-                    text = [p.get_text() for p in soup.find_all('p')]
-                    content = ' '.join(text.copy())
-                    text_en = text  # [translator.translate(x, target_language="en")["translatedText"] for x in text]
-                    content_en = ' '.join(text_en.copy())
-                elif 'summary' in entry.keys():
-                    content = re.sub(r"<(.*)>", "", entry['summary'])  # clean summary (without HTML leftovers)
-                    content_en = content  # translator.translate(content, target_language="en")["translatedText"]
+                    new_entries.append((entry, datetime_entry))
+                polled[source_name] = (len(new_entries), polled[source_name][1])
+            report.count('dedup', source_name, entries_in=len(entries), entries_out=len(new_entries))
+
+            # titles and summaries in other languages are translated first, for the prefilter to match them
+            texts = [clean_html(entry[key]) for entry, _ in new_entries for key in ('title', 'summary')
+                     if key in entry.keys()]
+            translated = {} if offline else self.translate_texts(texts)
+            for entry, datetime_entry in new_entries:
+                # cheap filter on title and summary, before downloading the article (offline, there is
+                # no download to save and the cached article of every entry is scanned)
+                report.count('prefilter', source_name, entries_in=1)
+                if offline or self.staged_filter(source_name, entry, translated):
+                    report.count('prefilter', source_name, entries_out=1)
+                    yield source_name, entry, datetime_entry
+                else:
+                    report.reject('prefilter', source_name, 'no_download')
+
+    def translate_texts(self, texts):
+        """{text: English translation} of `texts`, empty unless TRANSLATE is set."""
+        if not os.environ.get('TRANSLATE') or not texts:
+            return {}
+        translator = get_translator()
+        # not under self.lock, the translator and its cache have locks of their own: other polls keep
+        # going while a batch is sent to the translation service
+        with self.report.timer('translate'):
+            translated = dict(zip(texts, translator.translate_many(texts)))
+            translator.log_report()
+        self.report.count('translate', entries_in=len(texts))
+        return translated
+
+    def fetch_article(self, candidate):
+        """
+        Article of a (source, entry, published) candidate, as (raw page, charset, paragraphs) from the article
+        cache or (raw page, charset, None) downloaded, None if it could not be downloaded.
+        """
+        source_name, entry, _ = candidate
+        with self.report.timer('article_cache', source_name):
+            cached = self.article_cache.get(entry['id'])
+        self.report.count('article_cache', source_name, entries_in=1, entries_out=int(cached is not None),
+                          hits=int(cached is not None), misses=int(cached is None))
+        if cached is not None:
+            return cached
+        if self.article_cache.offline:
+            self.report.reject('article_cache', source_name, 'offline')
+            return None
+        with self.report.timer('article_download', source_name):
+            page = self.downloader.fetch(entry['id'])
+        self.report.count('article_download', source_name, entries_in=1, entries_out=int(page is not None),
+                          bytes=len(page[0]) if page is not None else 0)
+        return None if page is None else (*page, None)
+
+    def parse_articles(self, downloads):
+        """
+        ((source, entry, published), PageResult or None) for the downloaded (candidate, page), parsed in
+        the processes of the page parser, in order. Offline, articles missing from the cache are left out
+        rather than saved with their summary (and counted as seen).
+        """
+        for candidate, page, result in self.page_parser.map(downloads):
+            source_name, entry, _ = candidate
+            if page is None and self.article_cache.offline:
+                continue
+            if result is not None:
+                self.report.count('html_parse', source_name, entries_in=1, entries_out=1, calls=1,
+                                  seconds=result.seconds, bytes=len(page[0]))
+                if page[2] is None:
+                    self.article_cache.put(entry['id'], page[0], page[1], result.paragraphs)
+            yield candidate, result
+
+    @staticmethod
+    def sink_stats(sink):
+        return [(output.name, (output.rows_written, output.calls, output.retries, output.elapsed))
+                for output in getattr(sink, 'sinks', [sink])]
+
+    def record_sink(self, sheet, sink, before):
+        # one stage per output: sheets_write, sqlite_write, parquet_write
+        for (name, stats), (_, stats_before) in zip(self.sink_stats(sink), before):
+            rows, calls, retries, elapsed = (after - value for after, value in zip(stats, stats_before))
+            self.report.count(f'{name}_write', sheet, entries_in=rows, entries_out=rows, calls=calls,
+                              retries=retries, seconds=elapsed)
+
+    def select_articles(self, pages):
+        """
+        Rows of the Articles sheet for the downloaded candidates, as ((source, entry, published), PageResult),
+        that are about the location and match a keyword.
+        """
+        # translate the titles, paragraphs and summaries of the whole batch at once (only if TRANSLATE is set)
+        texts = []
+        for (_, entry, _), page in pages:
+            texts.append(clean_html(entry['title']))
+            if page is not None:
+                if page.language != 'en':  # english articles are kept as they are
+                    texts.extend(page.paragraphs)
+            elif 'summary' in entry.keys():
+                texts.append(clean_html(entry['summary']))
+        translated = self.translate_texts(texts)
+
+        entries = []
+        for (source_name, entry, datetime_entry), page in pages:
+            title = clean_html(entry['title'])  # clean title (without HTML leftovers)
+            title_en = translated.get(title, title)  # translate title to english
+
+            if page is not None:
+                content = ' '.join(page.paragraphs)
+                if translated and page.language != 'en':
+                    content_en = ' '.join(translated.get(x, x) for x in page.paragraphs)
                 else:
-                    content = title
-                    content_en = title_en
-
-                # filter by location
-                if not ('syria' in title_en.lower() or 'syria' in content_en.lower() or
-                        'سوريا' in title.lower() or 'سوريا' in content.lower()):
-                    logging.info('This entry is not about Syria:')
-                    logging.info(f"{title_en}")
-                    logging.info(f"{content_en}")
-                    logging.info('---------------------------------------')
-                    continue
-
-                # filter by keyword
-                if not any(keyword.lower() in title_en.lower() or keyword.lower() in content_en.lower() for keyword in
-                           keywords):
-                    logging.info('This entry is not relevant:')
-                    logging.info(f"{title_en}")
-                    logging.info(f"{content_en}")
-                    logging.info('---------------------------------------')
-                    continue
-
-                # create simple entry
-                entry_simple = {
-                    'Date': datetime_entry.strftime("%d/%m/%Y"),
-                    'Time': datetime_entry.strftime("%H:%M"),
-                    # 'Title (en)': title_en,
-                    'Title': title,
-                    # 'Content (en)': content_en,
-                    'Content': content,
-                    'Source': source_name,
-                    'Source+datetime': f'{source_name}, {datetime_entry.strftime("%d/%m/%Y")} {datetime_entry.strftime("%H:%M")}',
-                    'Link': entry['link'],
-                    'datetime': datetime_entry
-                }
-                entries.append(entry_simple)
-
-        entries_sorted = sorted(entries, key=lambda d: d['datetime'])  # sort entries by date (from oldest to newest)
-
-        # add entries to google sheet
-        logging.info('updating Google sheet')
-        for entry in tqdm(entries_sorted):
-            # add new row to google sheet
-            body = {'values': [list(entry.values())[:-1]]}
-            result = service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id, range=spreadsheet_range,
-                valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body=body).execute()
-            sleep(1)
-
-        # Twitter
-        twitter_sources = {
-            'SANA Syria': 'SANAEnOfficial',
-            'Alwatan Syria': 'AlwatanSy',
-            'HashtagSyria': 'presshashtag',
-            'Almasdar Online': 'AlmasdaronlineE',
-            'Alghad': 'AlghadNews',
-            'Shaam': 'ShaamNetwork',
-            'Syrian Observatory for Human Rights': 'syriahr',
-            'Baladi News': 'baladinetwork',
-            'North Press Agency': 'NPA_Arabic',
-            'Sky News Arabia': 'skynewsarabia',
-            'Al Maydeen': 'Almayadeennews',
-            'Monte Carlo Doualiya': 'MC_Doualiya',
-            'BBC Arabic': 'BBCArabic'
-        }
-
-        spreadsheet_id = '1p8zMlaXlC-3BpPbl5Yb61u6VZRUIxD1Gc2yo7PJ9ScY'
-        spreadsheet_range = 'Tweets!A:L'
-        # get data already in the spreadsheet
-        result = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
-                                                     range=spreadsheet_range).execute()
-        values = result.get('values', [])
-        df_old_values = pd.DataFrame.from_records(values[1:], columns=values[0])
-        df_old_values['created_at'] = pd.to_datetime(df_old_values['created_at'])
-
-        auth = tweepy.OAuthHandler(os.environ['TWITTER_API_KEY'], os.environ['TWITTER_API_SECRET'])
-        auth.set_access_token(os.environ['TWITTER_ACCESS_TOKEN'], os.environ['TWITTER_ACCESS_SECRET'])
-        api = tweepy.API(auth, wait_on_rate_limit=True)
-
-        twitter_data_path = "../data"
-        os.makedirs(twitter_data_path, exist_ok=True)
-
-        # track individual twitter accounts
-        for source_name, source_id in twitter_sources.items():
-            # save output as
-            save_file = twitter_data_path + '/tweets_' + source_id + '.json'
-            tweets = api.user_timeline(
-                screen_name=source_id,
-                count=200,
-                include_rts=False,
-                tweet_mode='extended'
-            )
-
-            all_tweets = []
-            all_tweets.extend(tweets)
-            oldest_id = tweets[-1].id
-            while True:
-                tweets = api.user_timeline(
-                    screen_name=source_id,
-                    count=200,
-                    include_rts=False,
-                    max_id=oldest_id - 1,
-                    tweet_mode='extended'
-                )
-                if len(tweets) == 0:
-                    break
-                oldest_id = tweets[-1].id
-                all_tweets.extend(tweets)
-
-            with open(save_file, 'a') as tf:
-                for tweet in all_tweets:
-                    try:
-                        tf.write('\n')
-                        json.dump(tweet._json, tf)
-                    except Exception as e:
-                        logging.warning("Some error occurred, skipping tweet:")
-                        logging.warning(e)
-                        pass
-
-        # parse tweets and store in dataframe
-        df_tweets = pd.DataFrame()
-        for file in os.listdir(twitter_data_path):
-            if file.endswith('.json'):
-                df_tweets_ = pd.read_json(os.path.join(twitter_data_path, file), lines=True)
-                df_tweets = df_tweets.append(df_tweets_, ignore_index=True)
-
-        # drop duplicates
-        df_tweets = df_tweets.drop_duplicates(subset=['id'])
-        df_tweets = format_df(df_tweets)
-
-        df_tweets['relevant'] = True
-        for ix, row in df_tweets.iterrows():
-            # skip if link already present in google sheet
-            if not df_old_values.empty:
-                if row['url'] in df_old_values['url'].unique():
-                    df_tweets.at[ix, 'relevant'] = False
-
-            if row['created_at'].date() < datetime.date.fromisoformat('2023-02-06'):
-                df_tweets.at[ix, 'relevant'] = False
-
-            # filter by location
-            if not ('syria' in row['full_text'] or 'سوريا' in row['full_text']):
-                df_tweets.at[ix, 'relevant'] = False
+                    content_en = content
+            elif 'summary' in entry.keys():
+                content = clean_html(entry['summary'])  # clean summary (without HTML leftovers)
+                content_en = translated.get(content, content)
+            else:
+                content = title
+                content_en = title_en
+
+            self.report.count('filter', source_name, entries_in=1)
+            # filter by location (the paragraphs were already scanned by the page parser)
+            if page is not None:
+                about_location = page.about_location or is_about_location(
+                    title_en, title, *([content_en] if content_en is not content else []))
+            else:
+                about_location = is_about_location(title_en, content_en, title, content)
+            if not about_location:
+                logging.info('This entry is not about Syria:')
+                logging.info(f"{title_en}")
+                logging.info(f"{content_en}")
+                logging.info('---------------------------------------')
+                self.report.reject('filter', source_name, 'not_about_location')
+                continue
 
             # filter by keyword
-            if not any(keyword.lower() in row['full_text'].lower() for keyword in keywords):
-                df_tweets.at[ix, 'relevant'] = False
-        df_tweets = df_tweets[df_tweets['relevant']].drop(columns=['relevant'])
-
-        df_tweets = df_tweets.sort_values(by='created_at')
-        df_tweets['created_at'] = df_tweets['created_at'].astype(str)
-        df_tweets = df_tweets.fillna('')
-
-        # add entries to google sheet
-        logging.info('updating Google sheet')
-        for ix, row in df_tweets.iterrows():
-            # add new row to google sheet
-            body = {'values': [list(row.values)]}
-            result = service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id, range=spreadsheet_range,
-                valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body=body).execute()
-            sleep(1)
-
-    except Exception as e:
-        logging.error(f"{e}")
+            if page is not None and content_en is content:
+                matched_keywords = self.keyword_matcher.merge(self.keyword_matcher.findall(title_en), page.keywords)
+            else:
+                matched_keywords = self.keyword_matcher.findall(title_en, content_en)
+            if not matched_keywords:
+                logging.info('This entry is not relevant:')
+                logging.info(f"{title_en}")
+                logging.info(f"{content_en}")
+                logging.info('---------------------------------------')
+                self.report.reject('filter', source_name, 'no_keyword')
+                continue
+            self.report.count('filter', source_name, entries_out=1)
+
+            # create simple entry
+            entry_simple = {
+                'Date': datetime_entry.strftime("%d/%m/%Y"),
+                'Time': datetime_entry.strftime("%H:%M"),
+                # 'Title (en)': title_en,
+                'Title': title,
+                # 'Content (en)': content_en,
+                'Content': content,
+                'Source': source_name,
+                'Source+datetime': f'{source_name}, {datetime_entry.strftime("%d/%m/%Y")} {datetime_entry.strftime("%H:%M")}',
+                'Link': entry['link'],
+                'Keywords': ', '.join(matched_keywords),
+                'datetime': datetime_entry
+            }
+            entries.append(entry_simple)
+        return entries
+
+    def fetch_tweets(self, accounts, since_ids):
+        """(name, new tweets) per account, the tweets of one account are kept together to put them in order."""
+        from pipeline.tweets import fetch_new_tweets
+        api = get_twitter_api()
+        for source_name, source_id in accounts.items():
+            with self.report.timer('twitter_fetch', source_name):
+                tweets = [tweet._json for tweet in fetch_new_tweets(api, source_id, since_id=since_ids[source_id])]
+            self.report.count('twitter_fetch', source_name, entries_out=len(tweets))
+            yield source_name, tweets
+
+    def run_tweets(self, accounts):
+        """
+        Fetch the tweets posted by `accounts` ({name: screen name}) since the last poll and add the relevant
+        ones to the sheet. Returns {name: (number of new tweets, their publication times)}.
+        """
+        tweet_store = self.tweet_store
+        with self.lock:
+            for source_id in accounts.values():
+                legacy_file = twitter_data_path + '/tweets_' + source_id + '.json'
+                if os.path.exists(legacy_file):
+                    tweet_store.import_legacy(source_id, legacy_file)
+            since_ids = {source_id: tweet_store.since_id(source_id) for source_id in accounts.values()}
+
+        # fetch the next accounts while the tweets of the previous one are filtered and written
+        polled = {}
+        newest = {}
+        sink = self.sinks['Tweets']
+        sink_stats = self.sink_stats(sink)
+        for source_name, tweets in buffered(self.fetch_tweets(accounts, since_ids), maxsize=2):
+            source_id = accounts[source_name]
+            polled[source_name] = (len(tweets), [datetime.strptime(tweet['created_at'], tweet_time_format)
+                                                 for tweet in tweets])
+            if not tweets:
+                continue
+            newest[source_id] = max(tweet['id'] for tweet in tweets)
+            with self.lock:
+                added = tweet_store.append(source_id, tweets)
+                logging.info(f"{source_name}: {len(tweets)} tweets since {since_ids[source_id]}, {added} new in store")
+
+                # parse tweets and store in dataframe
+                with self.report.timer('format_df', source_name):
+                    df_tweets = format_df(tweets)
+                    df_tweets = df_tweets.drop_duplicates(subset=['id'])
+                self.report.count('format_df', source_name, entries_in=len(tweets), entries_out=len(df_tweets))
+                rejected = Counter()
+                with self.report.timer('tweet_filter', source_name):
+                    df_tweets = filter_tweets(df_tweets, self.keyword_matcher, self.seen_index, rejected=rejected)
+                self.report.count('tweet_filter', source_name, entries_in=sum(rejected.values()) + len(df_tweets),
+                                  entries_out=len(df_tweets))
+                for reason, n_tweets in rejected.items():
+                    self.report.reject('tweet_filter', source_name, reason, n_tweets)
+
+                df_tweets = df_tweets.sort_values(by='created_at')
+                df_tweets['created_at'] = df_tweets['created_at'].astype(str)
+                df_tweets = df_tweets.fillna('')
+                sink.extend(df_tweets.to_dict('records'))
+
+        with self.lock:
+            sink.flush()
+            self.record_sink('Tweets', sink, sink_stats)
+            # move since_id forward only once the new tweets are saved
+            for source_id, since_id in newest.items():
+                tweet_store.set_since_id(source_id, since_id)
+            tweet_store.save_state()
+        return polled
+
+
+def main():
+
+    utc_timestamp = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
+    report = RunReport()
+
+    # PROFILE=cprofile or PROFILE=pyinstrument to find out where a slow run spends its time
+    with profiled(os.environ.get('PROFILE')):
+        pipeline = None
+        try:
+            pipeline = Pipeline(report=report)
+            with report.timer('sync'):
+                pipeline.sync(rebuild=bool(os.environ.get('REBUILD_SEEN_INDEX')))
+        except Exception:
+            logging.exception("Could not sync with the Google sheet")
+            report.error('sync', traceback.format_exc())
+            pipeline = None  # the stages need the seen index and the sinks of the sync, skip them
+
+        # articles and tweets are independent, a failure in one does not stop the other
+        if pipeline is not None:
+            for stage, run in (('articles', lambda: pipeline.run_articles(sources)),
+                               ('tweets', lambda: pipeline.run_tweets(twitter_sources))):
+                try:
+                    run()
+                except Exception:
+                    logging.exception(f"Could not process the {stage}")
+                    report.error(stage, traceback.format_exc())
+            try:
+                pipeline.close()
+            except Exception:
+                logging.exception("Could not close the outputs")
+                report.error('close', traceback.format_exc())
+
+    report.finish()
+    report.log_summary()
+    report.write_json(os.environ.get('RUN_REPORT', run_report_file))
+    if os.environ.get('PROMETHEUS_FILE'):
+        report.write_prometheus(os.environ['PROMETHEUS_FILE'])
 
     logging.info("Python timer trigger function ran at %s", utc_timestamp)
 
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import logging
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from pipeline.watermarks import as_utc
+
+seen_index_file = "../data/seen.sqlite"
+tracking_parameters = ('utm_', 'fbclid', 'gclid', 'ocid')
+# timezone of the Date/Time columns read back from the sheet
+sheet_timezone = timezone(timedelta(hours=3))
+
+
+def normalize_url(url):
+    """Canonical form of a URL: no scheme, www., fragment, tracking parameters or trailing slash."""
+    parts = urlsplit(str(url).strip())
+    netloc = parts.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if not key.lower().startswith(tracking_parameters)))
+    return urlunsplit(('', netloc, parts.path.rstrip('/'), query, '')).lstrip('/')
+
+
+def to_utc_iso(timestamp):
+    # stored as UTC so that they compare as strings, naive timestamps are UTC as for the watermarks
+    return as_utc(timestamp).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+def article_keys(row):
+    # row of the Articles sheet, as {column: value}; rows written by the pipeline also have the exact 'datetime'
+    if not row.get('Link'):
+        return []
+    published = row.get('datetime')
+    if published is None:
+        try:
+            published = datetime.strptime(f"{row.get('Date')} {row.get('Time')}",
+                                          "%d/%m/%Y %H:%M").replace(tzinfo=sheet_timezone)
+        except ValueError:
+            published = None
+    published = to_utc_iso(published) if published is not None else None
+    return [('article', normalize_url(row['Link']), row.get('Source'), published)]
+
+
+def tweet_keys(row):
+    # row of the Tweets sheet, as {column: value}
+    keys = []
+    if row.get('id'):
+        keys.append(('tweet', str(row['id']), row.get('source'), row.get('created_at')))
+    if row.get('url'):
+        keys.append(('tweet_url', normalize_url(row['url']), row.get('source'), row.get('created_at')))
+    return keys
+
+
+class SeenIndex:
+    """
+    Local index of the links and tweet ids already in the Google sheet, so that the sheet does not
+    have to be downloaded on every run. `sync` only reads the rows added since the last sync;
+    `rebuild` reads the whole sheet again.
+    """
+
+    def __init__(self, path=seen_index_file):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)  # callers serialize access (see Pipeline.lock)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                sheet TEXT,
+                source TEXT,
+                published TEXT,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS seen_source ON seen (kind, source, published);
+            CREATE TABLE IF NOT EXISTS sheets (
+                sheet TEXT PRIMARY KEY,
+                header TEXT,
+                row_count INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def seen(self, kind, key):
+        return self.db.execute("SELECT 1 FROM seen WHERE kind = ? AND key = ?", (kind, key)).fetchone() is not None
+
+    def seen_many(self, kind, keys, chunk_size=500):
+        """The subset of `keys` already in the index."""
+        keys = list(set(keys))
+        found = set()
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            found.update(key for key, in self.db.execute(
+                f"SELECT key FROM seen WHERE kind = ? AND key IN ({', '.join('?' * len(chunk))})", (kind, *chunk)))
+        return found
+
+    def add_many(self, keys, sheet=None):
+        # keys as (kind, key, source, published)
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO seen (kind, key, sheet, source, published) VALUES (?, ?, ?, ?, ?)",
+                [(kind, key, sheet, source, published) for kind, key, source, published in keys])
+
+    def latest_by_source(self, kind):
+        """Most recent `published` value stored per source, as {source: published}."""
+        return dict(self.db.execute(
+            "SELECT source, MAX(published) FROM seen WHERE kind = ? AND published IS NOT NULL GROUP BY source",
+            (kind,)))
+
+    def row_count(self, sheet):
+        row = self.db.execute("SELECT row_count FROM sheets WHERE sheet = ?", (sheet,)).fetchone()
+        return row[0] if row else 0
+
+    def sync(self, service, spreadsheet_id, spreadsheet_range, to_keys, page_size=10000):
+        """Add the keys of the rows appended to the sheet since the last sync, returns the sheet's row count."""
+        sheet, columns = spreadsheet_range.split('!')
+        first_column, last_column = columns.split(':')
+        row = self.db.execute("SELECT header, row_count FROM sheets WHERE sheet = ?", (sheet,)).fetchone()
+        header, row_count = (row[0].split('\t'), row[1]) if row and row[0] else (None, 0)
+        new_rows = 0
+        while True:
+            start = row_count + 1
+            result = service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=f"{sheet}!{first_column}{start}:{last_column}{start + page_size - 1}").execute()
+            values = result.get('values', [])
+            if not values:
+                break
+            row_count += len(values)
+            if header is None:
+                header, values = values[0], values[1:]
+            self.add_many((key for values_row in values for key in to_keys(dict(zip(header, values_row)))),
+                          sheet=sheet)
+            new_rows += len(values)
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO sheets (sheet, header, row_count) VALUES (?, ?, ?)",
+                                (sheet, '\t'.join(header), row_count))
+            if row_count < start + page_size - 1:
+                break
+        logging.info(f"Seen index: {new_rows} new rows in {sheet}, {row_count} rows in total")
+        return row_count
+
+    def rebuild(self, service, spreadsheet_id, spreadsheet_range, to_keys, **kwargs):
+        sheet = spreadsheet_range.split('!')[0]
+        logging.info(f"Seen index: rebuilding {sheet} from the sheet")
+        with self.db:
+            self.db.execute("DELETE FROM seen WHERE sheet = ?", (sheet,))
+            self.db.execute("DELETE FROM sheets WHERE sheet = ?", (sheet,))
+        return self.sync(service, spreadsheet_id, spreadsheet_range, to_keys, **kwargs)
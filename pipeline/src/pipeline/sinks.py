@@ -0,0 +1,399 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+from collections import defaultdict
+from datetime import timezone
+from urllib.parse import quote
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+
+def http_status(error):
+    # status of a googleapiclient HttpError (without importing googleapiclient), None for other errors
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def is_transient(error):
+    if http_status(error) is not None:
+        return http_status(error) in retry_statuses
+    # socket timeouts and connection errors
+    return isinstance(error, OSError)
+
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+class Sink:
+    """
+    Output of the pipeline: rows are added one at a time or in bulk and written in chunks, `flush` writes
+    what is pending. `on_write` is called with the rows of every chunk once it is written.
+    Every sink counts `rows_written`, `calls`, `retries` and the `elapsed` time spent writing.
+    """
+    name = 'sink'
+
+    def __init__(self, on_write=None):
+        self.on_write = on_write
+        self.rows_written = 0
+        self.calls = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    def add(self, row):
+        raise NotImplementedError
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class MultiSink(Sink):
+    """
+    Writes every row to all of `sinks`, e.g. to the Google sheet and to a local database, which write in
+    chunks of their own. `on_write` is called with the rows once they are written to every sink, so that
+    rows a sink failed to write are never counted as saved.
+    """
+    name = 'multi'
+
+    def __init__(self, sinks, on_write=None):
+        super().__init__(on_write)
+        self.sinks = list(sinks)
+        # id of the row -> [row, number of sinks it is not written to yet]
+        self.unwritten = {}
+        for sink in self.sinks:
+            sink.on_write = self._written
+
+    def add(self, row):
+        self.unwritten[id(row)] = [row, len(self.sinks)]
+        for sink in self.sinks:
+            sink.add(row)
+
+    def _written(self, rows):
+        done = []
+        for row in rows:
+            pending = self.unwritten.get(id(row))
+            if pending is None:
+                continue
+            pending[1] -= 1
+            if not pending[1]:
+                done.append(self.unwritten.pop(id(row))[0])
+        if done and self.on_write is not None:
+            self.on_write(done)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class SheetsSink(Sink):
+    """
+    Collects rows and appends them to a Google sheet in chunks.
+
+    Pacing adapts to the quota: there is no delay between calls until the API answers 429, after which
+    the delay doubles (up to `max_delay`) and decays again on every successful call. If a call fails
+    in a way that leaves unclear whether the rows landed (timeouts, 5xx), the rows after `start_row`
+    (the number of rows in the sheet before writing) are read back and compared on `key_column`,
+    so that retrying never duplicates rows.
+
+    Rows can be any object if `to_values` turns them into the list of cell values.
+    """
+    name = 'sheets'
+
+    def __init__(self, service, spreadsheet_id, spreadsheet_range, start_row=None, key_column=None,
+                 chunk_size=200, chunk_bytes=2_000_000, max_retries=8, max_delay=64, sleep=time.sleep,
+                 clock=time.perf_counter, to_values=None, on_write=None):
+        super().__init__(on_write)
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.spreadsheet_range = spreadsheet_range
+        self.sheet = spreadsheet_range.split('!')[0]
+        self.next_row = None if start_row is None else start_row + 1
+        self.key_column = key_column
+        self.chunk_size = chunk_size
+        self.chunk_bytes = chunk_bytes
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.clock = clock
+        self.to_values = to_values
+        self.delay = 0.0
+        self.pending = []
+        self.pending_values = []
+        self.pending_bytes = 0
+
+    def add(self, row):
+        values = self.to_values(row) if self.to_values is not None else row
+        self.pending.append(row)
+        self.pending_values.append(values)
+        self.pending_bytes += len(json.dumps(values, default=str))
+        if len(self.pending) >= self.chunk_size or self.pending_bytes >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        rows, values = self.pending, self.pending_values
+        self.pending, self.pending_values, self.pending_bytes = [], [], 0
+        if rows:
+            start = self.clock()
+            self._write(values)
+            self.elapsed += self.clock() - start
+            if self.on_write is not None:
+                self.on_write(rows)
+
+    def close(self):
+        self.flush()
+        if self.rows_written:
+            logging.info(f"Wrote {self.rows_written} rows to {self.sheet} in {self.calls} calls, "
+                         f"{self.elapsed:.1f}s ({self.rows_per_second:.1f} rows/s, {self.retries} retries)")
+
+    @property
+    def rows_per_second(self):
+        return self.rows_written / self.elapsed if self.elapsed else 0.0
+
+    def _append(self, rows):
+        self.calls += 1
+        return self.service.spreadsheets().values().append(
+            spreadsheetId=self.spreadsheet_id, range=self.spreadsheet_range,
+            valueInputOption="USER_ENTERED", insertDataOption="INSERT_ROWS", body={'values': rows}).execute()
+
+    def _landed(self, rows):
+        """Number of leading `rows` already present in the sheet at `next_row`."""
+        if self.next_row is None:
+            return 0
+        first, last = self.next_row, self.next_row + len(rows) - 1
+        result = self.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"{self.sheet}!A{first}:{column_letter(max(len(row) for row in rows) - 1)}{last}").execute()
+        present = result.get('values', [])
+        landed = 0
+        for row, row_present in zip(rows, present):
+            key = self.key_column
+            expected = str(row[key]) if key is not None else [str(value) for value in row]
+            found = (row_present[key] if len(row_present) > key else '') if key is not None else row_present
+            if expected != found:
+                break
+            landed += 1
+        return landed
+
+    def _write(self, rows):
+        attempt = 0
+        unsure = False  # whether a failed call might have written (part of) the rows anyway
+        while rows:
+            if self.delay:
+                self.sleep(self.delay)
+            try:
+                if unsure:
+                    landed = self._landed(rows)
+                    self._advance(landed)
+                    rows, unsure = rows[landed:], False
+                    if not rows:
+                        break
+                result = self._append(rows)
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                self.delay = min(max(2 * self.delay, 1.0), self.max_delay)
+                if http_status(e) == 429:
+                    logging.warning(f"Sheets quota exceeded, retrying in {self.delay:.0f}s")
+                else:
+                    logging.warning(f"Sheets call failed ({e}), checking which rows landed before retrying")
+                    unsure = True
+                continue
+            self._advance(len(rows), result)
+            rows = []
+            self.delay = self.delay / 2 if self.delay >= 0.1 else 0.0
+
+    def _advance(self, n_rows, result=None):
+        self.rows_written += n_rows
+        updated_range = (result or {}).get('updates', {}).get('updatedRange', '')
+        match = re.search(r'(\d+)$', updated_range)
+        if match:
+            self.next_row = int(match.group(1)) + 1
+        elif self.next_row is not None:
+            self.next_row += n_rows
+
+
+class BufferedSink(Sink):
+    """
+    Base of the local sinks: rows are turned into records ({field: value}) by `to_record` and written
+    `chunk_size` at a time by `_write`. `fields` maps every field to its type: 'text', 'integer',
+    'real' or 'timestamp' (an aware datetime, stored in UTC).
+    """
+
+    def __init__(self, fields, to_record=None, chunk_size=5000, on_write=None, clock=time.perf_counter):
+        super().__init__(on_write)
+        unknown = set(fields.values()) - set(field_types)
+        if unknown:
+            raise ValueError(f"Unknown field types {unknown}, should be one of {list(field_types)}")
+        self.fields = fields
+        self.to_record = to_record
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self.pending = []
+        self.pending_records = []
+
+    def add(self, row):
+        self.pending.append(row)
+        self.pending_records.append(self.to_record(row) if self.to_record is not None else row)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        rows, records = self.pending, self.pending_records
+        self.pending, self.pending_records = [], []
+        if rows:
+            start = self.clock()
+            self._write(records)
+            self.calls += 1
+            self.rows_written += len(rows)
+            self.elapsed += self.clock() - start
+            if self.on_write is not None:
+                self.on_write(rows)
+
+    def _write(self, records):
+        raise NotImplementedError
+
+
+field_types = {'text': 'TEXT', 'integer': 'INTEGER', 'real': 'REAL', 'timestamp': 'TEXT'}
+
+
+def as_utc_iso(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def sql_value(value, field_type):
+    if value is None or value == '':
+        return None if field_type != 'text' else value
+    if field_type == 'timestamp':
+        return as_utc_iso(value)
+    if field_type == 'text' and not isinstance(value, str):
+        return json.dumps(value, default=str)
+    return value
+
+
+class SQLiteSink(BufferedSink):
+    """
+    Table in a local SQLite database, one row per record, with an index on every field in `indexes`.
+    Records whose `key` is already in the table are ignored, so writing the same rows twice is harmless.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, table, fields, key=None, indexes=(), **kwargs):
+        super().__init__(fields, **kwargs)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.table = table
+        self.db = sqlite3.connect(path, check_same_thread=False)  # shared by the daemon threads, one at a time
+        columns = [f'"{field}" {field_types[field_type]}' + (' PRIMARY KEY' if field == key else '')
+                   for field, field_type in fields.items()]
+        self.db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(columns)})')
+        for field in indexes:
+            self.db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{field}" ON "{table}" ("{field}")')
+        names = ', '.join(f'"{field}"' for field in fields)
+        self.insert = f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({", ".join("?" * len(fields))})'
+
+    def _write(self, records):
+        with self.db:
+            self.db.executemany(self.insert, [
+                [sql_value(record.get(field), field_type) for field, field_type in self.fields.items()]
+                for record in records])
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+class ParquetSink(BufferedSink):
+    """
+    Parquet dataset partitioned Hive-style (e.g. path/month=2023-02/part-<ns>.parquet), readable
+    with pyarrow.dataset, pandas or DuckDB. Every flush adds one file per partition; once a partition
+    has `max_parts` files they are compacted into one.
+    """
+    name = 'parquet'
+
+    def __init__(self, path, fields, partition_by=None, max_parts=16, **kwargs):
+        kwargs.setdefault('chunk_size', 20000)
+        super().__init__(fields, **kwargs)
+        self.path = path
+        self.partition_by = partition_by  # record -> {partition key: value}
+        self.max_parts = max_parts
+
+    @property
+    def schema(self):
+        import pyarrow as pa
+        types = {'text': pa.string(), 'integer': pa.int64(), 'real': pa.float64(),
+                 'timestamp': pa.timestamp('us', tz='UTC')}
+        return pa.schema([(field, types[field_type]) for field, field_type in self.fields.items()])
+
+    def _partition(self, record):
+        if self.partition_by is None:
+            return self.path
+        return os.path.join(self.path, *(f"{key}={quote(str(value), safe=' ')}"
+                                         for key, value in self.partition_by(record).items()))
+
+    def _column(self, records, field, field_type):
+        values = [record.get(field) for record in records]
+        if field_type == 'text':
+            return [value if value is None or isinstance(value, str) else json.dumps(value, default=str)
+                    for value in values]
+        if field_type == 'timestamp':
+            return [value if value is None or value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+                    for value in values]
+        return [None if value == '' else value for value in values]
+
+    def _write(self, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        partitions = defaultdict(list)
+        for record in records:
+            partitions[self._partition(record)].append(record)
+        schema = self.schema
+        for partition, partition_records in partitions.items():
+            table = pa.table({field: self._column(partition_records, field, field_type)
+                              for field, field_type in self.fields.items()}, schema=schema)
+            self._write_table(partition, table)
+            parts = self._parts(partition)
+            if len(parts) >= self.max_parts:
+                self._write_table(partition, pa.concat_tables([pq.read_table(part) for part in parts]))
+                for part in parts:
+                    os.remove(part)
+
+    @staticmethod
+    def _parts(partition):
+        return sorted(os.path.join(partition, file) for file in os.listdir(partition)
+                      if file.startswith('part-') and file.endswith('.parquet'))
+
+    @staticmethod
+    def _write_table(partition, table):
+        import pyarrow.parquet as pq
+        os.makedirs(partition, exist_ok=True)
+        file = os.path.join(partition, f'part-{time.time_ns()}.parquet')
+        pq.write_table(table, file + '.tmp')
+        os.replace(file + '.tmp', file)
@@ -0,0 +1,99 @@
+"""
+Building blocks of the streaming stages: every stage is a generator, and none of them holds more than
+a bounded number of items, so that memory does not grow with the number of entries going through.
+"""
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def chunked(iterable, size):
+    """Lists of up to `size` consecutive items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ordered_map(fn, items, max_workers=8, window=None):
+    """(item, fn(item)) for every item, in order, with at most `window` calls running or waiting to be read."""
+    window = window or 2 * max_workers
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(fn, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def completed_map(fn, items, max_workers=8, window=None):
+    """(item, fn(item)) for every item, as soon as each call completes, with at most `window` calls pending."""
+    window = window or max_workers
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(fn, item)] = item
+            while len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+
+_done = object()
+
+
+def buffered(iterable, maxsize=4):
+    """
+    Iterate `iterable` in a background thread, at most `maxsize` items ahead of the consumer,
+    so that the producer (e.g. fetching) and the consumer (e.g. writing) overlap.
+    Exceptions of the producer are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_done, None))
+        except BaseException as e:
+            put((_done, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
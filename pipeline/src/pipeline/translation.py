@@ -0,0 +1,190 @@
+import os
+import time
+import functools
+import sqlite3
+import hashlib
+import logging
+import threading
+
+translation_cache_file = "../data/translations.sqlite"
+
+
+class TranslationCache:
+    """Persistent cache of translations by content hash, evicting the least recently used above `max_bytes`."""
+
+    def __init__(self, path=translation_cache_file, max_bytes=200_000_000):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        # daemon polls translate in their own threads, calls on the shared connection are serialized
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                translation TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used);
+        """)
+        self.total = self.size()
+
+    @staticmethod
+    def key(backend, text):
+        return hashlib.sha256(f"{backend}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys, chunk_size=500):
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                found.update(self.db.execute(
+                    f"SELECT key, translation FROM translations WHERE key IN ({', '.join('?' * len(chunk))})", chunk))
+            if found:
+                with self.db:
+                    self.db.executemany("UPDATE translations SET last_used = ? WHERE key = ?",
+                                        [(time.time(), key) for key in found])
+        return found
+
+    def put_many(self, translations, chunk_size=500):
+        now = time.time()
+        rows = [(key, translation, len(key) + len(translation.encode()), now)
+                for key, translation in translations.items()]
+        keys = list(translations)
+        with self._lock:
+            with self.db:
+                for i in range(0, len(keys), chunk_size):
+                    chunk = keys[i:i + chunk_size]
+                    self.total -= self.db.execute(
+                        f"SELECT COALESCE(SUM(size), 0) FROM translations WHERE key IN ({', '.join('?' * len(chunk))})",
+                        chunk).fetchone()[0]
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO translations (key, translation, size, last_used) VALUES (?, ?, ?, ?)", rows)
+            self.total += sum(row[2] for row in rows)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+
+    def evict(self):
+        excess = self.total - self.max_bytes
+        if excess <= 0:
+            return
+        keys, freed = [], 0
+        for key, size in self.db.execute("SELECT key, size FROM translations ORDER BY last_used"):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        with self.db:
+            self.db.executemany("DELETE FROM translations WHERE key = ?", keys)
+        self.total -= freed
+        logging.info(f"Translation cache: evicted {len(keys)} translations ({freed} bytes)")
+
+
+class GoogleTranslateBackend:
+    """Google Translate (translate_v2 client), sending many texts (`q` values) per request."""
+
+    def __init__(self, client, target_language='en', batch_size=128, batch_chars=30000):
+        self.client = client
+        self.target_language = target_language
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.name = f"google-translate:{target_language}"
+
+    def batches(self, texts):
+        batch, chars = [], 0
+        for text in texts:
+            if batch and (len(batch) >= self.batch_size or chars + len(text) > self.batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(text)
+            chars += len(text)
+        if batch:
+            yield batch
+
+    def translate(self, texts):
+        translations = []
+        for batch in self.batches(texts):
+            results = self.client.translate(batch, target_language=self.target_language, format_='text')
+            translations.extend(result['translatedText'] for result in results)
+        return translations
+
+
+@functools.lru_cache(maxsize=None)
+def load_translation_pipeline(task, model_name):
+    """Hugging Face pipeline, loaded on first use and then kept warm for the lifetime of the process."""
+    from transformers import pipeline
+    return pipeline(task, model=model_name)
+
+
+class MarianBackend:
+    """
+    Hugging Face translation pipeline (e.g. MarianMT), translating padded batches of texts of similar length.
+    The model is only loaded once there is something to translate that is not in the cache.
+    """
+
+    def __init__(self, model_name, task='translation', translator=None, batch_size=16):
+        self.model_name = model_name
+        self.task = task
+        self.translator = translator
+        self.batch_size = batch_size
+        self.name = f"transformers:{model_name}"
+
+    def translate(self, texts):
+        if self.translator is None:
+            self.translator = load_translation_pipeline(self.task, self.model_name)
+        # sort by length so that every batch needs as little padding as possible
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = self.translator([texts[i] for i in order], batch_size=self.batch_size, truncation=True)
+        translations = [None] * len(texts)
+        for i, result in zip(order, results):
+            translations[i] = result['translation_text']
+        return translations
+
+
+class Translator:
+    """Translates texts through a cache: duplicates are translated once, cache misses are sent in batches."""
+
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache
+        self._lock = threading.Lock()  # for the counters, translations of several threads run at once
+        self.hits = 0
+        self.misses = 0
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    def translate_many(self, texts):
+        unique = list(dict.fromkeys(text for text in texts if text and text.strip()))
+        keys = {text: TranslationCache.key(self.backend.name, text) for text in unique}
+        cached = self.cache.get_many(list(keys.values())) if self.cache is not None else {}
+        translations = {text: cached[key] for text, key in keys.items() if key in cached}
+        missing = [text for text in unique if text not in translations]
+        with self._lock:
+            self.hits += len(translations)
+            self.misses += len(missing)
+        if missing:
+            start = time.perf_counter()
+            translated = self.backend.translate(missing)
+            with self._lock:
+                self.elapsed += time.perf_counter() - start
+                self.tokens += sum(len(text.split()) for text in missing)
+            translations.update(zip(missing, translated))
+            if self.cache is not None:
+                self.cache.put_many({keys[text]: translations[text] for text in missing})
+        return [translations.get(text, text) for text in texts]
+
+    def translate(self, text):
+        return self.translate_many([text])[0]
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def log_report(self):
+        tokens_per_second = self.tokens / self.elapsed if self.elapsed else 0.0
+        logging.info(f"Translation: {self.hits + self.misses} unique texts, {100 * self.hit_rate:.0f}% from cache, "
+                     f"{self.tokens} tokens translated in {self.elapsed:.1f}s ({tokens_per_second:.0f} tokens/s)")
@@ -0,0 +1,131 @@
+import os
+import glob
+import json
+import time
+import logging
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+tweets_path = "../data/tweets"
+schema = pa.schema([
+    ('id', pa.int64()),
+    ('created_at', pa.string()),
+    ('json', pa.string())
+])
+
+
+def fetch_new_tweets(api, screen_name, since_id=None, count=200):
+    """Tweets of an account newer than `since_id` (all available tweets if None), newest first."""
+    tweets = []
+    max_id = None
+    while True:
+        kwargs = {'screen_name': screen_name, 'count': count, 'include_rts': False, 'tweet_mode': 'extended'}
+        if since_id is not None:
+            kwargs['since_id'] = since_id
+        if max_id is not None:
+            kwargs['max_id'] = max_id
+        page = api.user_timeline(**kwargs)
+        if len(page) == 0:
+            break
+        tweets.extend(page)
+        max_id = page[-1].id - 1
+    return tweets
+
+
+class TweetStore:
+    """
+    Append-only store of raw tweets, one directory of Parquet files per account. Every append writes
+    only the tweets not stored yet; once an account has `max_parts` files they are compacted into one.
+    Also keeps the `since_id` per account, i.e. the newest tweet that has been fully processed.
+    """
+
+    def __init__(self, path=tweets_path, max_parts=16):
+        self.path = path
+        self.max_parts = max_parts
+        self.state_file = os.path.join(path, 'state.json')
+        os.makedirs(path, exist_ok=True)
+        self.state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+    def _parts(self, screen_name):
+        return sorted(glob.glob(os.path.join(self.path, screen_name, 'part-*.parquet')))
+
+    def _write(self, screen_name, table):
+        account_path = os.path.join(self.path, screen_name)
+        os.makedirs(account_path, exist_ok=True)
+        file = os.path.join(account_path, f'part-{time.time_ns()}.parquet')
+        pq.write_table(table, file + '.tmp')
+        os.replace(file + '.tmp', file)
+
+    def read(self, screen_name, columns=None):
+        parts = self._parts(screen_name)
+        if not parts:
+            return schema.empty_table() if columns is None else schema.empty_table().select(columns)
+        return pa.concat_tables([pq.read_table(part, columns=columns) for part in parts])
+
+    def known_ids(self, screen_name):
+        return set(self.read(screen_name, columns=['id']).column('id').to_pylist())
+
+    def records(self, screen_name):
+        """All stored tweets of an account, as tweet dicts."""
+        return [json.loads(tweet) for tweet in self.read(screen_name, columns=['json']).column('json').to_pylist()]
+
+    def append(self, screen_name, tweets):
+        """Store tweets (as tweet dicts) not stored yet, returns the number of tweets added."""
+        known = self.known_ids(screen_name)
+        new = {}
+        for tweet in tweets:
+            if tweet['id'] not in known and tweet['id'] not in new:
+                new[tweet['id']] = tweet
+        if new:
+            self._write(screen_name, pa.table({
+                'id': list(new),
+                'created_at': [tweet.get('created_at') for tweet in new.values()],
+                'json': [json.dumps(tweet) for tweet in new.values()]
+            }, schema=schema))
+            if len(self._parts(screen_name)) >= self.max_parts:
+                self.compact(screen_name)
+        return len(new)
+
+    def compact(self, screen_name):
+        parts = self._parts(screen_name)
+        if len(parts) < 2:
+            return
+        table = self.read(screen_name)
+        ids = table.column('id').to_pylist()
+        first = {}
+        for i, tweet_id in enumerate(ids):
+            first.setdefault(tweet_id, i)
+        table = table.take(sorted(first.values(), key=lambda i: ids[i]))
+        self._write(screen_name, table)
+        for part in parts:
+            os.remove(part)
+        logging.info(f"Compacted {len(parts)} files of {screen_name} into one ({table.num_rows} tweets)")
+
+    def import_legacy(self, screen_name, json_file):
+        """Move tweets from an old newline-delimited tweets_<account>.json file into the store."""
+        tweets = []
+        with open(json_file) as f:
+            for line in f:
+                if line.strip():
+                    tweets.append(json.loads(line))
+        added = self.append(screen_name, tweets)
+        os.replace(json_file, json_file + '.imported')
+        logging.info(f"Imported {added} tweets of {screen_name} from {json_file}")
+
+    def since_id(self, screen_name):
+        if screen_name in self.state:
+            return self.state[screen_name]
+        # no state yet (e.g. after importing old files): continue from the newest stored tweet
+        ids = self.known_ids(screen_name)
+        return max(ids) if ids else None
+
+    def set_since_id(self, screen_name, since_id):
+        self.state[screen_name] = since_id
+
+    def save_state(self):
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.state_file + '.tmp', self.state_file)
@@ -0,0 +1,56 @@
+import calendar
+import logging
+from datetime import datetime, timezone
+
+
+def as_utc(timestamp):
+    # naive timestamps (feeds without a timezone) are taken to be UTC
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def feed_updated(feed):
+    """
+    Feed-level update time (`updated` of the channel) as an aware UTC datetime, or None. The channel's
+    `published` date is not used, it can be much older than the latest entries.
+    """
+    parsed = feed.get('updated_parsed')
+    if not parsed:
+        return None
+    return datetime.fromtimestamp(calendar.timegm(parsed), tz=timezone.utc)
+
+
+class WatermarkStore:
+    """
+    Latest timestamp seen per source (the high-water mark), computed once per run from the seen index
+    and kept up to date as entries are saved. Entries older than the watermark of their source are skipped.
+    """
+
+    def __init__(self, watermarks=None):
+        self.watermarks = {source: as_utc(timestamp) for source, timestamp in (watermarks or {}).items()}
+
+    @classmethod
+    def from_index(cls, seen_index, kind='article'):
+        latest = seen_index.latest_by_source(kind)
+        return cls({source: datetime.fromisoformat(published) for source, published in latest.items() if source})
+
+    def get(self, source):
+        return self.watermarks.get(source)
+
+    def is_older(self, source, timestamp):
+        watermark = self.watermarks.get(source)
+        return watermark is not None and as_utc(timestamp) < watermark
+
+    def feed_is_stale(self, source, feed):
+        """True if the feed says it was last updated before the watermark, so none of its entries can be newer."""
+        updated = feed_updated(feed)
+        if updated is None or not self.is_older(source, updated):
+            return False
+        logging.info(f"{source} was last updated at {updated}, before {self.watermarks[source]}, skipping feed")
+        return True
+
+    def update(self, source, timestamp):
+        timestamp = as_utc(timestamp)
+        if source not in self.watermarks or timestamp > self.watermarks[source]:
+            self.watermarks[source] = timestamp